@@ -1,46 +1,62 @@
 import os                                   # Provides functions for interacting with the operating system
 import pygame                               # Library for creating graphical applications and handling input/output
-import pyautogui                            # Library for taking screenshots
+import numpy as np                          # Fast array maths used by the image preprocessing engine
 import sys                                  # Provides system-specific functions and parameters
 import pytesseract                          # Python wrapper for the Google Tesseract OCR engine
 import threading                            # Allows running separate threads for concurrent execution
 import time                                 # Provides time-related functions like sleep
 import tkinter as tk                        # GUI library for creating additional windows
-from PIL import Image                       # Library for image processing and manipulation
+from PIL import Image, ImageOps, ImageStat        # Library for image processing and manipulation
 import sqlite3                              # SQLite database library for data storage and retrieval
 from datetime import datetime               # Used to work with dates and times
 import hashlib                              # Provides hashing functions (I used sha256)
+import argparse                             # Parses the optional command line arguments (capture source, benchmark)
+import ctypes                               # Calls into native libraries (X11 shared memory capture on Linux)
+import ctypes.util                          # Finds those native libraries on the system
+import mmap                                 # Memory maps session recordings so they can be written and replayed fast
+import struct                               # Packs the record headers of session recordings
+from collections import OrderedDict         # Keeps the OCR result cache in least recently used order
+from concurrent.futures import ProcessPoolExecutor  # Runs the OCR worker processes
+from multiprocessing import resource_tracker, shared_memory  # Hands preprocessed images to the OCR workers
 
 # Initializing pygame and configuring the Tesseract executable path
 pygame.init()
 pytesseract.pytesseract.tesseract_cmd = os.path.join(os.getcwd(), r"Tesseract-OCR/tesseract.exe")
 
+# Creates the 'patient' and 'vaccination' tables if they do not exist
+def create_tables(cursor):
+    # Includes a data_hash column for data integrity checks
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS patient (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        age REAL,
+        vaccine_type TEXT,
+        patient_name TEXT,
+        data_hash TEXT
+    )
+    ''')
+    # Establishing a foreign key relationship with the patient table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS vaccination (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER,
+        vaccine_type TEXT,
+        date_administered TEXT,
+        FOREIGN KEY (patient_id) REFERENCES patient(ID)
+    )
+    ''')
+
+# Connects to (or creates if non-existent) an SQLite database and makes sure its tables exist. Benchmarks pass
+# ":memory:" so replayed OCR results never reach the real patient records
+def open_database(path):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA foreign_keys = ON")  # Enabling support for foreign key constraints in SQLite
+    create_tables(connection.cursor())
+    connection.commit()  # Commiting changes to the database
+    return connection
+
 # Connecting to or creating if non-existent an SQLite database named 'NHS Database.sqlite'
-test = sqlite3.connect('../NHS Database.sqlite')
-cursor = test.cursor()
-cursor.execute("PRAGMA foreign_keys = ON")  # Enabling support for foreign key constraints in SQLite
-
-# Creating the 'patient' table if it does not exist. Includes a data_hash column for data integrity checks
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS patient (
-    ID INTEGER PRIMARY KEY AUTOINCREMENT,
-    age REAL,
-    vaccine_type TEXT,
-    patient_name TEXT,
-    data_hash TEXT
-)
-''')
-# Creating the 'vaccination' table if it does not exist. Establishing a foreign key relationship with the patient table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS vaccination (
-    ID INTEGER PRIMARY KEY AUTOINCREMENT,
-    patient_id INTEGER,
-    vaccine_type TEXT,
-    date_administered TEXT,
-    FOREIGN KEY (patient_id) REFERENCES patient(ID)
-)
-''')
-test.commit()  # Commiting changes to the database
+test = open_database('../NHS Database.sqlite')
 
 # Function to compute an sha256 hash for a record for data integrity purposes
 def compute_record_hash(age, patient_name, vaccine_type):
@@ -56,7 +72,11 @@ def letterbox_image(image, target_width, target_height, background_color=(50, 50
     scale = min(target_width / orig_width, target_height / orig_height)  # Compute scale factor
     new_width = int(orig_width * scale)         # Calculate new width after scaling
     new_height = int(orig_height * scale)       # Calculate new height after scaling
-    scaled_image = pygame.transform.smoothscale(image, (new_width, new_height))  # Smoothly scale the image
+    if image.get_bitsize() >= 24:
+        scaled_image = pygame.transform.smoothscale(image, (new_width, new_height))  # Smoothly scale the image
+    else:
+        # 8 bit grayscale previews of the binarised OCR input cannot be smoothscaled, and a plain scale keeps them sharp
+        scaled_image = pygame.transform.scale(image, (new_width, new_height))
     letterboxed_surface = pygame.Surface((target_width, target_height))  # Create a new surface with target dimensions
     letterboxed_surface.fill(background_color)  # Fill the surface with a background color for padding and "black bars" effect
     x_offset = (target_width - new_width) // 2  # Calculate horizontal offset to center the image
@@ -64,56 +84,1874 @@ def letterbox_image(image, target_width, target_height, background_color=(50, 50
     letterboxed_surface.blit(scaled_image, (x_offset, y_offset))  # Blit the scaled image onto the letterboxed surface
     return letterboxed_surface
 
-# Base class for OCR processors. Contains common image processing methods for OCR.
+# A block of pixel memory that PIL and pygame can both read without copying it. PIL images are made with
+# Image.frombuffer and pygame surfaces with pygame.image.frombuffer, so both share the same bytes. The old path of
+# convert("RGB") -> tobytes() -> pygame.image.fromstring copied every frame three times
+class FrameBuffer:
+    bytes_per_pixel = {"RGBX": 4, "RGBA": 4, "BGRX": 4, "RGB": 3, "L": 1}
+    pygame_formats = {"RGBX": "RGBX", "RGBA": "RGBA", "BGRX": "BGRA", "RGB": "RGB", "L": "P"}
+    grayscale_palette = [(level, level, level) for level in range(256)]  # Palette for 8 bit grayscale surfaces
+
+    def __init__(self, buffer, size, mode, stride=None):
+        self.buffer = buffer                  # Any object supporting the buffer protocol (bytes, bytearray, mmap...)
+        self.size = size                      # (width, height) in pixels
+        self.mode = mode                      # Raw pixel layout, one of the bytes_per_pixel keys
+        self.stride = stride or size[0] * self.bytes_per_pixel[mode]  # Bytes from the start of one row to the next
+
+    # Wraps a PIL image, making a single copy of its pixels (PIL does not expose its own memory)
+    @classmethod
+    def from_image(cls, image):
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("L" if image.mode == "1" else "RGB")
+        return cls(image.tobytes(), image.size, image.mode)
+
+    # Returns a pygame surface that shares this buffer. Grayscale buffers become 8 bit surfaces with a gray palette
+    def to_surface(self):
+        frame = self if self.stride == self.size[0] * self.bytes_per_pixel[self.mode] else self.crop((0, 0) + self.size)
+        surface = pygame.image.frombuffer(frame.buffer, frame.size, self.pygame_formats[self.mode])
+        if self.mode == "L":
+            surface.set_palette(self.grayscale_palette)
+        elif self.mode == "BGRX":
+            surface.set_alpha(None)  # pygame has no BGRX, so the BGRA surface's pad byte (usually 0) must not be alpha
+        return surface
+
+    # Returns a PIL image. RGBX, RGBA and L buffers are shared, other layouts are unpacked to RGB in a single pass
+    def to_image(self):
+        if self.mode in ("RGBX", "RGBA", "L"):
+            return Image.frombuffer(self.mode, self.size, self.buffer, "raw", self.mode, self.stride, 1)
+        return Image.frombuffer("RGB", self.size, self.buffer, "raw", self.mode, self.stride, 1)
+
+    # Returns a new, tightly packed FrameBuffer holding the (x, y, width, height) rectangle. Only the rectangle's
+    # rows are copied, through memoryview slices rather than intermediate byte strings
+    def crop(self, rect):
+        x, y, width, height = rect
+        bpp = self.bytes_per_pixel[self.mode]
+        row_bytes = width * bpp
+        source = memoryview(self.buffer).cast("B")
+        cropped = bytearray(row_bytes * height)
+        for row in range(height):
+            start = (y + row) * self.stride + x * bpp
+            cropped[row * row_bytes:(row + 1) * row_bytes] = source[start:start + row_bytes]
+        return FrameBuffer(cropped, (width, height), self.mode)
+
+# Turns a PIL image into a pygame surface with as few copies as possible. Binarised OCR images become 8 bit grayscale
+# surfaces, a third of the size of the RGB surfaces they used to be converted to
+def image_to_surface(image):
+    return FrameBuffer.from_image(image).to_surface()
+
+# Picks Otsu thresholds for a stack of 256 bin histograms at once. For every candidate level the between-class
+# variance of the pixels below and at-or-above it is computed with cumulative sums, and the level with the largest
+# variance wins. Returns the thresholds (pixels below them become black) and that variance, which is close to zero for
+# flat areas with no text in them
+def otsu_thresholds(histograms):
+    histograms = np.asarray(histograms, dtype=np.float64).reshape(-1, 256)
+    total = histograms.sum(axis=1, keepdims=True)
+    weight_dark = np.cumsum(histograms, axis=1)              # Pixel count at or below each level
+    weight_light = total - weight_dark
+    sum_dark = np.cumsum(histograms * np.arange(256), axis=1)
+    sum_all = sum_dark[:, -1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (sum_dark * total - sum_all * weight_dark) ** 2 / (total ** 2 * weight_dark * weight_light)
+    variance = np.nan_to_num(variance, nan=0.0, posinf=0.0)
+    levels = variance.argmax(axis=1)
+    return levels + 1, variance[np.arange(len(levels)), levels]
+
+# Base class for one stage of a PreprocessingPipeline. A stage takes the array the stage before it returned and
+# returns a new one. params() lists every setting that changes the output, so the pipeline can tell whether a
+# memoised result is still good. Each stage keeps its own work buffers and timing counters
+class PreprocessingStage:
+    name = "stage"
+
+    def __init__(self):
+        self.buffers = {}                     # Preallocated work arrays, keyed by name
+        self.calls = 0                        # Times the stage actually ran
+        self.seconds = 0.0                    # Total time spent running it
+        self.memo_hits = 0                    # Times the memoised output was reused instead
+
+    # Returns a reusable array of the given shape and type, only allocating when the shape changes
+    def buffer(self, name, shape, dtype):
+        array = self.buffers.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.buffers[name] = np.empty(shape, dtype)
+        return array
+
+    def params(self):
+        return ()
+
+    def run(self, data):
+        raise NotImplementedError
+
+    # Returns the average time of a run in milliseconds
+    def mean_ms(self):
+        return self.seconds * 1000 / self.calls if self.calls else 0.0
+
+# Turns a PIL image into the weighted 16 bit luminance sum using fixed point weights (77, 150, 29 out of 256, the same
+# as PIL's 0.299/0.587/0.114). Grayscale images come out as their gray levels times 256. The later stages index lookup
+# tables with these sums, so the divide by 256 never has to be done on its own
+class GrayscaleStage(PreprocessingStage):
+    name = "grayscale"
+    luminance_weights = (77, 150, 29)         # Fixed point versions of 0.299, 0.587 and 0.114, summing to 256
+
+    def run(self, screenshot):
+        if screenshot.mode not in ("RGB", "RGBA", "RGBX", "L"):
+            screenshot = screenshot.convert("RGB")
+        pixels = np.asarray(screenshot)
+        weighted = self.buffer("weighted", pixels.shape[:2], np.uint16)
+        if screenshot.mode == "L":
+            np.left_shift(pixels, 8, out=weighted, dtype=np.uint16)
+            return weighted
+        scratch = self.buffer("scratch", pixels.shape[:2], np.uint16)
+        red_weight, green_weight, blue_weight = self.luminance_weights
+        np.multiply(pixels[..., 0], red_weight, out=weighted, dtype=np.uint16)
+        np.multiply(pixels[..., 1], green_weight, out=scratch, dtype=np.uint16)
+        weighted += scratch
+        np.multiply(pixels[..., 2], blue_weight, out=scratch, dtype=np.uint16)
+        weighted += scratch
+        return weighted
+
+# Flips regions showing light text on a dark background (dark mode) to dark text on white like every other region,
+# the same idea as convert_image in "dark to light mode.py" but done live without touching disk. A region counts as
+# dark mode when its mean luminance is below dark_level. After inverting, pixels at least background_level bright are
+# forced to pure white as convert_image does, which leaves the Otsu modes one clean background peak
+class DarkModeStage(PreprocessingStage):
+    name = "dark_mode"
+
+    def __init__(self, enabled=True, dark_level=128, background_level=220):
+        super().__init__()
+        self.enabled = enabled
+        self.dark_level = dark_level
+        self.background_level = background_level
+        self.inverted = False                 # Whether the latest frame was treated as dark mode
+
+    def params(self):
+        return self.enabled, self.dark_level, self.background_level
+
+    def run(self, weighted):
+        self.inverted = self.enabled and weighted.mean() < self.dark_level << 8
+        if not self.inverted:
+            return weighted
+        brightest = 255 << 8
+        inverted = self.buffer("inverted", weighted.shape, np.uint16)
+        np.subtract(brightest, weighted, out=inverted)
+        background = self.buffer("background", weighted.shape, np.bool_)
+        np.greater_equal(inverted, self.background_level << 8, out=background)
+        np.putmask(inverted, background, brightest)
+        return inverted
+
+# Binarises the weighted luminance into an 8 bit array of 0 (ink) and 255 (background). The mode picks how the threshold
+# is chosen: "fixed" always uses the threshold given, through a 65536 entry lookup table indexed by the weighted sum so
+# the divide and threshold happen in one pass. "otsu" picks one threshold per frame from the histogram, and "adaptive"
+# picks one per tile so grey-on-grey panels next to white ones both come out clean. Otsu and adaptive decisions are
+# cached and reused until the region's histogram shifts
+class ThresholdStage(PreprocessingStage):
+    name = "threshold"
+    tile_size = 32                            # Tile edge in pixels for the adaptive mode
+    min_variance = 50.0                       # Below this between-class variance a tile or frame is treated as blank
+    histogram_tolerance = 0.05                # Fraction of pixels that must move bins before the threshold is redone
+
+    def __init__(self, threshold=128, mode="fixed"):
+        super().__init__()
+        self.threshold = threshold
+        self.mode = mode
+        self.tables = {}                      # Lookup tables from the 16 bit weighted sum to 0/255, per threshold
+        self.cached_shape = None              # Shape of the region the cached decision was made for
+        self.cached_histogram = None          # Normalised histogram (one per tile in adaptive mode) it was made from
+        self.cached_decision = None           # (mode, threshold or per-tile thresholds) chosen for that histogram
+        self.last_threshold = threshold       # Threshold used for the latest frame, shown in the debug output
+
+    def params(self):
+        return self.mode, self.threshold
+
+    # Returns the lookup table from the 16 bit weighted sum straight to black (0) or white (255) for a threshold
+    def threshold_table(self, threshold):
+        table = self.tables.get(threshold)
+        if table is None:
+            table = self.tables[threshold] = np.where((np.arange(65536) >> 8) < threshold, 0, 255).astype(np.uint8)
+        return table
+
+    # Returns True if there is a cached decision for this mode and region size
+    def cache_is_valid(self, shape):
+        return self.cached_decision is not None and self.cached_decision[0] == self.mode and self.cached_shape == shape
+
+    # Returns, for each normalised histogram row, whether it has moved from the cached one by more than the tolerance.
+    # Half the summed difference is the fraction of pixels that changed bins
+    def histogram_moved(self, histograms):
+        return np.abs(self.cached_histogram - histograms).sum(axis=-1) / 2 > self.histogram_tolerance
+
+    # Returns a single Otsu threshold for the frame, falling back to the fixed threshold for a blank frame
+    def otsu_threshold(self, histogram):
+        thresholds, variances = otsu_thresholds(histogram)
+        return int(thresholds[0]) if variances[0] >= self.min_variance else self.threshold
+
+    # Returns the histogram of every 32 pixel tile of the gray image as a row of 256 counts, tiles in reading order
+    def tile_histograms(self, gray):
+        height, width = gray.shape
+        size = self.tile_size
+        tiles_down, tiles_across = -(-height // size), -(-width // size)
+        tile_index = self.buffers.get("tile_index")
+        if tile_index is None or tile_index.shape != gray.shape:
+            rows = (np.arange(height) // size)[:, None]
+            columns = (np.arange(width) // size)[None, :]
+            tile_index = self.buffers["tile_index"] = ((rows * tiles_across + columns) * 256).astype(np.intp)
+        histograms = np.bincount((tile_index + gray).ravel(), minlength=tiles_down * tiles_across * 256)
+        return histograms.reshape(tiles_down * tiles_across, 256)
+
+    # Returns the thresholds for a set of tile histograms. Tiles that are blank are background (a 32 pixel tile is
+    # bigger than any glyph stroke), so they get a threshold of 0 and come out white rather than having their noise
+    # stretched into speckles
+    def tile_thresholds(self, histograms):
+        thresholds, variances = otsu_thresholds(histograms)
+        thresholds[variances < self.min_variance] = 0
+        return thresholds.astype(np.uint8)
+
+    # Returns the per-tile thresholds for the frame. With a cached decision for a region of the same size only the
+    # tiles whose own histogram moved are redone, and so is any tile that was blank and now has anything at all in it,
+    # since a blank tile's threshold of 0 would wipe out text that has just appeared there (Ann Lee becoming Ann Leeds)
+    def adaptive_thresholds(self, gray):
+        histograms = self.tile_histograms(gray)
+        normalised = histograms / histograms.sum(axis=1, keepdims=True)
+        if not self.cache_is_valid(gray.shape):
+            decision = self.tile_thresholds(histograms)
+            self.cached_shape, self.cached_histogram = gray.shape, normalised
+            self.cached_decision = ("adaptive", decision)
+            return decision
+        decision = self.cached_decision[1]
+        redo = self.histogram_moved(normalised) | ((decision == 0) & (self.cached_histogram != normalised).any(axis=1))
+        if redo.any():
+            decision = decision.copy()
+            decision[redo] = self.tile_thresholds(histograms[redo])
+            self.cached_histogram = self.cached_histogram.copy()
+            self.cached_histogram[redo] = normalised[redo]
+            self.cached_decision = ("adaptive", decision)
+        return decision
+
+    # Binarises the 8 bit gray image into binary using the Otsu or adaptive mode
+    def binarise_histogram_mode(self, weighted, binary):
+        gray = self.buffer("gray", weighted.shape, np.uint8)
+        np.right_shift(weighted, 8, out=gray, casting="unsafe")
+        if self.mode == "otsu":
+            histogram = np.bincount(gray.ravel(), minlength=256) / gray.size
+            if self.cache_is_valid(gray.shape) and not self.histogram_moved(histogram):
+                decision = self.cached_decision[1]
+            else:
+                decision = self.otsu_threshold(histogram)
+                self.cached_shape, self.cached_histogram = gray.shape, histogram
+                self.cached_decision = ("otsu", decision)
+            self.last_threshold = decision
+            np.take(self.threshold_table(decision), weighted, out=binary)
+            return
+        # Spreads each tile's threshold over its pixels and compares the whole frame in one go
+        size = self.tile_size
+        height, width = gray.shape
+        decision = self.adaptive_thresholds(gray).reshape(-(-height // size), -(-width // size))
+        threshold_map = np.repeat(np.repeat(decision, size, axis=0), size, axis=1)[:height, :width]
+        text_tiles = decision[decision > 0]
+        self.last_threshold = int(np.median(text_tiles)) if text_tiles.size else 0
+        np.greater_equal(gray, threshold_map, out=binary, casting="unsafe")
+        binary *= 255
+
+    def run(self, weighted):
+        binary = self.buffer("binary", weighted.shape, np.uint8)
+        if self.mode == "fixed":
+            self.last_threshold = self.threshold
+            np.take(self.threshold_table(self.threshold), weighted, out=binary)  # Divide and threshold in one lookup
+        else:
+            self.binarise_histogram_mode(weighted, binary)
+        return binary
+
+# Cleans up speckle that survives the threshold, such as compression noise from remote desktop sessions, before it
+# reaches tesseract as dozens of extra blobs. Works on the ink mask (pixels that are 0) with whole-array operations:
+#   "speckle"  drops ink pixels whose 5x5 neighbourhood holds no more than max_speck ink pixels, found with box sums
+#              from an integral image. Specks of up to max_speck pixels vanish while strokes, which always have more
+#              ink around them, survive
+#   "open"     erodes then dilates the ink with a 3x3 square, removing anything thinner than 3 pixels
+#   "close"    dilates then erodes, filling pinholes and hairline gaps in strokes
+# The default "off" passes the array straight through. pixels_changed counts what each mode actually did so it can be
+# weighed against the stage time in the debug panel
+class DenoiseStage(PreprocessingStage):
+    name = "denoise"
+    modes = ("off", "speckle", "open", "close")
+    radius = 2                                # The speckle window is (2 * radius + 1) pixels square
+
+    def __init__(self, mode="off", max_speck=3):
+        super().__init__()
+        self.mode = mode
+        self.max_speck = max_speck
+        self.pixels_changed = 0               # Pixels flipped by the filter across every run
+
+    def params(self):
+        return self.mode, self.max_speck
+
+    # Returns the nine shifted views making up each pixel's 3x3 neighbourhood, padded with pad_value at the edges
+    def neighbourhood(self, mask, pad_value):
+        height, width = mask.shape
+        padded = self.buffer("padded", (height + 2, width + 2), np.bool_)
+        padded.fill(pad_value)
+        padded[1:-1, 1:-1] = mask
+        return [padded[row:row + height, column:column + width] for row in range(3) for column in range(3)]
+
+    # Returns the ink mask with every pixel that is not surrounded by ink removed. Outside the array counts as ink so
+    # text touching the edge is not eaten away
+    def erode(self, mask):
+        views = self.neighbourhood(mask, True)
+        eroded = self.buffer("eroded", mask.shape, np.bool_)
+        np.copyto(eroded, views[0])
+        for view in views[1:]:
+            np.logical_and(eroded, view, out=eroded)
+        return eroded
+
+    # Returns the ink mask grown by one pixel in every direction
+    def dilate(self, mask):
+        views = self.neighbourhood(mask, False)
+        dilated = self.buffer("dilated", mask.shape, np.bool_)
+        np.copyto(dilated, views[0])
+        for view in views[1:]:
+            np.logical_or(dilated, view, out=dilated)
+        return dilated
+
+    # Returns the ink mask without the pixels whose window holds max_speck or fewer ink pixels
+    def remove_specks(self, ink):
+        height, width = ink.shape
+        radius, size = self.radius, 2 * self.radius + 1
+        integral = self.buffer("integral", (height + size, width + size), np.int32)
+        integral.fill(0)
+        integral[radius + 1:radius + 1 + height, radius + 1:radius + 1 + width] = ink
+        np.cumsum(integral, axis=0, out=integral)
+        np.cumsum(integral, axis=1, out=integral)
+        window_sums = (integral[size:, size:] - integral[:-size, size:]
+                       - integral[size:, :-size] + integral[:-size, :-size])
+        return ink & (window_sums > self.max_speck)
+
+    def run(self, binary):
+        if self.mode == "off":
+            return binary
+        ink = self.buffer("ink", binary.shape, np.bool_)
+        np.equal(binary, 0, out=ink)
+        if self.mode == "speckle":
+            cleaned = self.remove_specks(ink)
+        elif self.mode == "open":
+            cleaned = self.dilate(self.erode(ink))
+        else:
+            cleaned = self.erode(self.dilate(ink))
+        self.pixels_changed += int(np.count_nonzero(cleaned != ink))
+        output = self.buffer("output", binary.shape, np.uint8)
+        np.logical_not(cleaned, out=ink)
+        np.multiply(ink, 255, out=output, casting="unsafe")
+        return output
+
+# Crops the binary array to the box around its ink pixels, found from the row and column projection profiles, plus a
+# margin of white. Operators tend to draw generous rectangles and this keeps the padding away from the upscale and
+# tesseract. The pixel counts before and after cropping are kept so the saving can be reported
+class CropStage(PreprocessingStage):
+    name = "crop"
+
+    def __init__(self, enabled=True, margin=3):
+        super().__init__()
+        self.enabled = enabled
+        self.margin = margin                  # White pixels kept around the text box, tesseract reads badly without a border
+        self.last_box = None                  # (left, top, right, bottom) of the latest crop in region pixels
+        self.pixels_original = 0              # Running totals of pixels before and after cropping
+        self.pixels_cropped = 0
+
+    def params(self):
+        return self.enabled, self.margin
+
+    # Returns the (left, top, right, bottom) box around the black pixels of a binary array plus the margin, or the whole
+    # array if it has no ink. A row or column holds ink exactly when its minimum is 0, which numpy reduces quickly
+    def text_box(self, binary):
+        height, width = binary.shape
+        ink_rows = np.flatnonzero(binary.min(axis=1) == 0)
+        if ink_rows.size == 0:
+            return 0, 0, width, height
+        ink_columns = np.flatnonzero(binary[ink_rows[0]:ink_rows[-1] + 1].min(axis=0) == 0)
+        margin = self.margin
+        return (max(int(ink_columns[0]) - margin, 0), max(int(ink_rows[0]) - margin, 0),
+                min(int(ink_columns[-1]) + 1 + margin, width), min(int(ink_rows[-1]) + 1 + margin, height))
+
+    # Returns the percentage of region pixels that were kept after cropping, across every frame so far
+    def crop_ratio(self):
+        if not self.pixels_original:
+            return 100.0
+        return self.pixels_cropped * 100.0 / self.pixels_original
+
+    def run(self, binary):
+        height, width = binary.shape
+        self.last_box = left, top, right, bottom = self.text_box(binary) if self.enabled else (0, 0, width, height)
+        cropped = binary[top:bottom, left:right]
+        self.pixels_original += binary.size
+        self.pixels_cropped += cropped.size
+        return cropped
+
+# Upscales the binary array by writing each pixel into a factor x factor block of the output. Scaling after
+# thresholding is the same as thresholding a nearest-neighbour upscale, so the output keeps the sharp edges tesseract
+# likes without running LANCZOS over nine times the pixels. With adaptive on, the factor is picked from the height of
+# the text, measured as the typical run of consecutive ink rows. Tesseract reads best with lines around 32 pixels tall,
+# so small fonts are blown up and large ones are passed through at 1x. The choice is cached until the text box changes
+# height
+class ScaleStage(PreprocessingStage):
+    name = "scale"
+    max_factor = 4
+    min_run = 4                               # Ink row runs shorter than this are underlines or noise, not text
+    scale_tolerance = 2                       # Pixels the text box height may drift before the scale is picked again
+
+    def __init__(self, factor=3, adaptive=True, target_text_height=32):
+        super().__init__()
+        self.factor = factor                  # Used when adaptive is off, or there is no text to measure
+        self.adaptive = adaptive
+        self.target_text_height = target_text_height
+        self.cached_scale = None              # (text box height, factor) of the last scale decision
+        self.last_factor = factor
+
+    def params(self):
+        return self.factor, self.adaptive, self.target_text_height
+
+    # Returns the typical height of a line of text in a binary array, from the lengths of the runs of rows with ink
+    # in them, or None if there is no text
+    def text_height(self, binary):
+        ink_rows = (binary.min(axis=1) == 0).astype(np.int8)
+        edges = np.diff(ink_rows, prepend=0, append=0)
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        runs = runs[runs >= self.min_run]
+        return int(np.median(runs)) if runs.size else None
+
+    # Returns the smallest whole upscale factor that brings the text up to target_text_height, reusing the cached
+    # factor while the text box stays the same height
+    def choose_factor(self, binary):
+        if not self.adaptive:
+            return self.factor
+        box_height = binary.shape[0]
+        if (self.cached_scale is not None and self.cached_scale[2] == self.target_text_height
+                and abs(self.cached_scale[0] - box_height) <= self.scale_tolerance):
+            return self.cached_scale[1]
+        text_height = self.text_height(binary)
+        if text_height is None:
+            return self.factor                # Nothing to measure, so nothing worth caching either
+        factor = min(max(-(-self.target_text_height // text_height), 1), self.max_factor)
+        self.cached_scale = (box_height, factor, self.target_text_height)
+        return factor
+
+    def run(self, binary):
+        height, width = binary.shape
+        self.last_factor = factor = self.choose_factor(binary)
+        # Always a fresh output array, since the preview surface and OCR may still be reading the previous one
+        if factor == 1:
+            return binary.copy()
+        upscaled = np.empty((height * factor, width * factor), np.uint8)
+        upscaled.reshape(height, factor, width, factor)[...] = binary[:, None, :, None]
+        return upscaled
+
+# Runs a list of stages one after another and times each of them. The output of every stage is memoised against a key
+# made of a digest of the input image and the params of that stage and every stage before it. Only the latest input
+# is kept, which is all the live loop needs: when a setting of a late stage is changed from the debug panel, the
+# region is run again and everything up to that stage comes straight from the memo
+class PreprocessingPipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.memo = [None] * len(self.stages)  # (key, output) of each stage for the latest input
+
+    # Returns the stage with the given name
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    # Forgets every memoised output so the next run does all the work again
+    def clear_memo(self):
+        self.memo = [None] * len(self.stages)
+
+    # Runs the image through every stage, or only up to and including the stage named last, and returns the output of
+    # the last stage run
+    def run(self, screenshot, last=None):
+        key = hashlib.blake2b(screenshot.tobytes(), digest_size=16)
+        key.update(f"{screenshot.mode} {screenshot.size}".encode())
+        key = key.digest()
+        data = screenshot
+        for index, stage in enumerate(self.stages):
+            key = (key, stage.params())
+            memo = self.memo[index]
+            if memo is not None and memo[0] == key:
+                stage.memo_hits += 1
+                data = memo[1]
+            else:
+                start_time = time.perf_counter()
+                data = stage.run(data)
+                stage.seconds += time.perf_counter() - start_time
+                stage.calls += 1
+                self.memo[index] = (key, data)
+            if stage.name == last:
+                break
+        return data
+
+    # Returns a short "stage: average ms" summary for the debug panel
+    def timing_summary(self):
+        return "  ".join(f"{stage.name}: {stage.mean_ms():.2f}ms" for stage in self.stages)
+
+# The default NumPy preprocessing engine doing the same job as BaseOCRProcessor.process_image_pil with whole-array
+# operations: grayscale, dark mode inversion, threshold, optional denoise, crop to the text and scale. Scaling the
+# binary image at the end, rather than the grayscale one first like the PIL chain, means every stage before it works on
+# a ninth of the pixels
+class NumpyPreprocessor(PreprocessingPipeline):
+    def __init__(self, threshold=128, upscale_factor=3, threshold_mode="fixed", detect_dark_mode=True):
+        super().__init__([GrayscaleStage(),
+                          DarkModeStage(detect_dark_mode),
+                          ThresholdStage(threshold, threshold_mode),
+                          DenoiseStage(),
+                          CropStage(),
+                          ScaleStage(upscale_factor)])
+
+    # Returns the binarised, upscaled image as a new mode "L" PIL image holding only 0 and 255
+    def process(self, screenshot):
+        result = self.run(screenshot)
+        height, width = result.shape
+        return Image.frombuffer("L", (width, height), result, "raw", "L", 0, 1)
+
+# Stacks preprocessed region images on one white canvas, each separated from the next and from the edges by a blank
+# band of gap pixels. Returns the canvas as a mode "L" image and the top row of every region on it
+def stitch_images(images, gap=32):
+    arrays = [np.asarray(image if image.mode == "L" else image.convert("L")) for image in images]
+    width = max(array.shape[1] for array in arrays) + 2 * gap
+    height = sum(array.shape[0] for array in arrays) + gap * (len(arrays) + 1)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+    tops = []
+    top = gap
+    for array in arrays:
+        canvas[top:top + array.shape[0], gap:gap + array.shape[1]] = array
+        tops.append(top)
+        top += array.shape[0] + gap
+    return Image.frombuffer("L", (width, height), canvas, "raw", "L", 0, 1), tops
+
+# Turns tesseract's TSV output (what image_to_data returns) into (left, top, width, height, confidence, text) tuples,
+# one per recognised word
+def parse_tsv(tsv):
+    words = []
+    for line in tsv.splitlines():
+        fields = line.split("\t")
+        if len(fields) < 12 or fields[0] != "5" or not fields[11].strip():
+            continue  # The header, the page, block, paragraph and line rows, and empty words
+        left, top, width, height = (int(value) for value in fields[6:10])
+        words.append((left, top, width, height, float(fields[10]), fields[11]))
+    return words
+
+# Base class for OCR backends. A backend turns a preprocessed image into text, so the processors never need to know
+# whether tesseract runs as a separate program or inside this process
+class BaseOCRBackend:
+    batch_config = "--psm 6"                  # A composite is read as one block of text, a line per region
+    batch_gap = 32                            # Blank pixels between the regions of a composite
+
+    # Returns (text, mean confidence 0-100 or None) for a PIL image read with a tesseract style config string
+    def recognise(self, image, config=""):
+        raise NotImplementedError
+
+    # Returns the words in an image as (left, top, width, height, confidence, text) tuples, like
+    # pytesseract.image_to_data
+    def image_to_data(self, image, config=""):
+        raise NotImplementedError
+
+    # Reads a list of (image, config) pairs with one tesseract call and returns their (text, confidence) results in
+    # the same order. The images are stitched into a composite, every word found is given back to the region whose band
+    # its centre lies in, and since one call cannot use a different whitelist per region, each region's
+    # tessedit_char_whitelist is applied to its words afterwards
+    def recognise_batch(self, jobs):
+        if len(jobs) == 1:
+            return [self.recognise(*jobs[0])]  # Nothing to share the call with, so the whitelist can be used as normal
+        canvas, tops = stitch_images([image for image, _ in jobs], self.batch_gap)
+        region_words = [[] for _ in jobs]
+        for left, top, width, height, confidence, text in self.image_to_data(canvas, self.batch_config):
+            centre = top + height / 2
+            index = max(0, sum(1 for region_top in tops if region_top - self.batch_gap / 2 <= centre) - 1)
+            region_words[index].append((text, confidence))
+        results = []
+        for (_, config), words in zip(jobs, region_words):
+            whitelist = self.parse_config(config)[1].get("tessedit_char_whitelist")
+            if whitelist is not None:
+                words = [("".join(character for character in text if character in whitelist), confidence)
+                         for text, confidence in words]
+                words = [(text, confidence) for text, confidence in words if text]
+            text = " ".join(text for text, _ in words)
+            confidence = round(sum(confidence for _, confidence in words) / len(words)) if words else None
+            results.append((text, confidence))
+        return results
+
+    # Splits a config string into its page segmentation mode (or None) and a dict of -c variables
+    @staticmethod
+    def parse_config(config):
+        page_mode, variables = None, {}
+        words = config.split()
+        for index, word in enumerate(words[:-1]):
+            if word == "--psm":
+                page_mode = int(words[index + 1])
+            elif word == "-c" and "=" in words[index + 1]:
+                name, value = words[index + 1].split("=", 1)
+                variables[name] = value
+        return page_mode, variables
+
+    def close(self):
+        pass
+
+# Runs the tesseract program through pytesseract. Each call starts a new tesseract process, writes the image to a
+# temporary file and loads the language data again, so this is the slow but always available fallback
+class PytesseractBackend(BaseOCRBackend):
+    # Reads the words with image_to_data rather than image_to_string so the one tesseract run also gives their
+    # confidences. The words are joined back up a line at a time, in the order tesseract found them
+    def recognise(self, image, config=""):
+        data = pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+        lines = {}
+        confidences = []
+        for block, paragraph, line, text, confidence in zip(data["block_num"], data["par_num"], data["line_num"],
+                                                             data["text"], data["conf"]):
+            if text.strip():
+                lines.setdefault((block, paragraph, line), []).append(text)
+                confidences.append(float(confidence))
+        text = "\n".join(" ".join(words) for words in lines.values())
+        return text, round(sum(confidences) / len(confidences)) if confidences else None
+
+    def image_to_data(self, image, config=""):
+        return parse_tsv(pytesseract.image_to_data(image, config=config))
+
+# Keeps tesseract loaded inside this process through the libtesseract C API, called with ctypes. The language data
+# is read once per config when its API handle is first made (one for the digit whitelist, one for general text and
+# so on) and the handles are then reused, so a read is just SetImage on the image's pixels in memory and GetUTF8Text.
+# Config strings use the same "--psm 7 -c name=value" syntax as pytesseract so the processors can pass either backend
+# the same thing.
+# The Tesseract-OCR folder shipped with this program only has tesseract.exe and the DLLs it needs, not
+# libtesseract-5.dll, so on its own it can only use the pytesseract backend. The full UB Mannheim install (by default
+# in Program Files) does have the DLL, and it is picked up from there, or it can be copied into Tesseract-OCR or
+# pointed to with TESSERACT_LIBRARY
+class TesseractAPIBackend(BaseOCRBackend):
+    library_names = ("libtesseract-5.dll", "libtesseract.so.5", "libtesseract.5.dylib")
+    source_resolution = 300                   # DPI reported to tesseract, which otherwise warns about every image
+
+    def __init__(self, library_path=None, datapath=None, language="eng"):
+        self.folder = os.path.join(os.getcwd(), "Tesseract-OCR")  # Where the shipped Windows build lives
+        self.library = self.load_library(library_path or os.environ.get("TESSERACT_LIBRARY"))
+        self.declare_functions()
+        if datapath is None and os.path.isdir(os.path.join(self.folder, "tessdata")):
+            datapath = os.path.join(self.folder, "tessdata")
+        self.datapath = datapath
+        self.language = language
+        self.handles = {}                     # Initialised API handles, keyed by config string
+        self.lock = threading.Lock()          # A handle must only be used by one thread at a time
+
+    # Loads libtesseract from the given path (or the TESSERACT_LIBRARY environment variable), the Tesseract-OCR folder
+    # next to this program, a standard Windows install or the system, raising OSError if none of them load
+    def load_library(self, library_path):
+        candidates = [library_path] if library_path else []
+        folders = [self.folder]
+        if os.environ.get("ProgramFiles"):
+            folders.append(os.path.join(os.environ["ProgramFiles"], "Tesseract-OCR"))
+        candidates += [os.path.join(folder, name) for folder in folders for name in self.library_names]
+        candidates.append(ctypes.util.find_library("tesseract"))
+        for path in candidates:
+            if not path or (os.path.sep in path and not os.path.exists(path)):
+                continue
+            if hasattr(os, "add_dll_directory") and os.path.dirname(path):
+                os.add_dll_directory(os.path.dirname(path))  # So Windows finds the DLLs libtesseract depends on
+            return ctypes.CDLL(path)
+        raise OSError("libtesseract not found")
+
+    # Declares the argument and return types so ctypes passes 64 bit pointers correctly
+    def declare_functions(self):
+        library = self.library
+        library.TessBaseAPICreate.restype = ctypes.c_void_p
+        library.TessBaseAPICreate.argtypes = []
+        library.TessBaseAPIInit3.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+        library.TessBaseAPISetVariable.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+        library.TessBaseAPISetPageSegMode.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        library.TessBaseAPISetImage.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int,
+                                                ctypes.c_int, ctypes.c_int]
+        library.TessBaseAPISetSourceResolution.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        library.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p  # Not c_char_p, the string has to be freed by DeleteText
+        library.TessBaseAPIGetUTF8Text.argtypes = [ctypes.c_void_p]
+        library.TessBaseAPIMeanTextConf.argtypes = [ctypes.c_void_p]
+        library.TessBaseAPIGetTsvText.restype = ctypes.c_void_p
+        library.TessBaseAPIGetTsvText.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        library.TessDeleteText.argtypes = [ctypes.c_void_p]
+        library.TessBaseAPIEnd.argtypes = [ctypes.c_void_p]
+        library.TessBaseAPIDelete.argtypes = [ctypes.c_void_p]
+
+    # Returns the API handle for a config, creating and initialising it the first time that config is seen
+    def handle(self, config):
+        handle = self.handles.get(config)
+        if handle is not None:
+            return handle
+        library = self.library
+        handle = library.TessBaseAPICreate()
+        datapath = self.datapath.encode() if self.datapath else None
+        if library.TessBaseAPIInit3(handle, datapath, self.language.encode()) != 0:
+            library.TessBaseAPIDelete(handle)
+            raise OSError(f"Could not load the '{self.language}' tesseract language data")
+        page_mode, variables = self.parse_config(config)
+        for name, value in variables.items():
+            library.TessBaseAPISetVariable(handle, name.encode(), value.encode())
+        if page_mode is not None:
+            library.TessBaseAPISetPageSegMode(handle, page_mode)
+        self.handles[config] = handle
+        return handle
+
+    # Hands an image's pixels to an API handle. Must be called with the lock held
+    def set_image(self, handle, image):
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("L")  # Mode "1" images from the PIL engine are one bit per pixel
+        bytes_per_pixel = len(image.mode)
+        self.library.TessBaseAPISetImage(handle, image.tobytes(), image.width, image.height, bytes_per_pixel,
+                                         image.width * bytes_per_pixel)
+        self.library.TessBaseAPISetSourceResolution(handle, self.source_resolution)
+
+    # Copies a string returned by the API into Python and frees it
+    def take_text(self, text_pointer):
+        if not text_pointer:
+            return ""
+        text = ctypes.string_at(text_pointer).decode("utf-8", "replace")
+        self.library.TessDeleteText(text_pointer)
+        return text
+
+    def recognise(self, image, config=""):
+        with self.lock:
+            handle = self.handle(config)
+            self.set_image(handle, image)
+            text_pointer = self.library.TessBaseAPIGetUTF8Text(handle)
+            confidence = self.library.TessBaseAPIMeanTextConf(handle)
+        return self.take_text(text_pointer), confidence
+
+    def image_to_data(self, image, config=""):
+        with self.lock:
+            handle = self.handle(config)
+            self.set_image(handle, image)
+            tsv_pointer = self.library.TessBaseAPIGetTsvText(handle, 0)
+        return parse_tsv(self.take_text(tsv_pointer))
+
+    # Shuts down and frees every API handle
+    def close(self):
+        with self.lock:
+            for handle in self.handles.values():
+                self.library.TessBaseAPIEnd(handle)
+                self.library.TessBaseAPIDelete(handle)
+            self.handles.clear()
+
+# Opens an OCR backend: "api" for libtesseract in process, "pytesseract" for the tesseract program, or None to use
+# libtesseract when it can be loaded and fall back to pytesseract otherwise
+def open_ocr_backend(kind=None):
+    if kind == "pytesseract":
+        return PytesseractBackend()
+    if kind == "api":
+        return TesseractAPIBackend()
+    try:
+        return TesseractAPIBackend()
+    except OSError as error:
+        # Expected with just the shipped Tesseract-OCR folder, see TesseractAPIBackend
+        print(f"libtesseract unavailable ({error}), falling back to pytesseract.")
+        return PytesseractBackend()
+
+# The OCR backend of an OCRWorkerPool worker process, opened once by ocr_worker_init when the process starts
+worker_ocr_backend = None
+
+# Runs in each worker process as it starts. Opens the OCR backend and, for the libtesseract backend, initialises a
+# handle for every config up front so the first real read is as quick as the rest
+def ocr_worker_init(kind, configs):
+    global worker_ocr_backend
+    worker_ocr_backend = open_ocr_backend(kind)
+    if isinstance(worker_ocr_backend, TesseractAPIBackend):
+        for config in configs:
+            worker_ocr_backend.handle(config)
+
+# Runs in a worker process. Reads the 8 bit grayscale image the parent left in a shared memory block and returns
+# (text, confidence, worker pid, seconds taken)
+def ocr_worker_recognise(memory_name, size, config):
+    start_time = time.perf_counter()
+    memory = shared_memory.SharedMemory(name=memory_name)
+    # On POSIX attaching registers the block with the resource tracker as if this process owned it. The parent unlinks
+    # it, so it is unregistered here to stop the tracker warning about (and unlinking) it a second time at exit. Windows
+    # has no resource tracker for shared memory, and asking it to unregister would try to start one
+    if os.name == "posix":
+        resource_tracker.unregister(memory._name, "shared_memory")
+    try:
+        image = Image.frombytes("L", size, memory.buf[:size[0] * size[1]])
+    finally:
+        memory.close()
+    text, confidence = worker_ocr_backend.recognise(image, config)
+    return text, confidence, os.getpid(), time.perf_counter() - start_time
+
+# Fixed-size pool of OCR worker processes, each with tesseract already loaded, so the regions of one frame are read in
+# parallel across cores instead of one after another. Preprocessed images are passed through shared memory blocks
+# rather than pickled, and each worker answers with the text and tesseract's mean confidence.
+# The pool keeps the metrics needed to size it: how many reads are queued or running (and the most there have been
+# at once), and the number of reads and average latency of each worker
+class OCRWorkerPool:
+    def __init__(self, workers=2, kind=None, configs=()):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=ocr_worker_init,
+                                            initargs=(kind, tuple(configs)))
+        self.lock = threading.Lock()
+        self.queue_depth = 0                  # Reads submitted but not yet answered
+        self.max_queue_depth = 0
+        self.worker_stats = {}                # Maps each worker pid to {"reads": count, "seconds": total}
+        # Starts every worker now, so the language data is loaded before the first frame rather than during it
+        for future in [self.executor.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+    # Sends a preprocessed image to the next free worker and returns a future for its (text, confidence)
+    def submit(self, image, config=""):
+        if image.mode != "L":
+            image = image.convert("L")
+        pixels = image.tobytes()
+        memory = shared_memory.SharedMemory(create=True, size=max(len(pixels), 1))
+        memory.buf[:len(pixels)] = pixels
+        with self.lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        future = self.executor.submit(ocr_worker_recognise, memory.name, image.size, config)
+        future.add_done_callback(lambda done: self.finished(done, memory))
+        return future
+
+    # Frees the shared memory of a finished read and records how long its worker took
+    def finished(self, future, memory):
+        memory.close()
+        memory.unlink()
+        with self.lock:
+            self.queue_depth -= 1
+            if future.exception() is None:
+                _, _, pid, seconds = future.result()
+                stats = self.worker_stats.setdefault(pid, {"reads": 0, "seconds": 0.0})
+                stats["reads"] += 1
+                stats["seconds"] += seconds
+
+    # Reads a list of (image, config) pairs in parallel and returns their (text, confidence) results in the same order.
+    # With an OCRResultCache only the images it has not seen are sent to the workers
+    def recognise_all(self, jobs, cache=None):
+        results = [None] * len(jobs)
+        futures = {}
+        for index, (image, config) in enumerate(jobs):
+            if cache is not None:
+                key = cache.key(image, config)
+                results[index] = cache.get(key)
+                if results[index] is not None:
+                    continue
+            futures[index] = (self.submit(image, config), key if cache is not None else None)
+        for index, (future, key) in futures.items():
+            results[index] = future.result()[:2]
+            if cache is not None:
+                cache.put(key, *results[index])
+        return results
+
+    # Returns a short summary of the queue depth and each worker's reads and average latency
+    def summary(self):
+        with self.lock:
+            parts = [f"queue {self.queue_depth} (max {self.max_queue_depth})"]
+            for pid, stats in sorted(self.worker_stats.items()):
+                parts.append(f"worker {pid}: {stats['reads']} reads, {stats['seconds'] * 1000 / stats['reads']:.1f}ms")
+        return "  ".join(parts)
+
+    def close(self):
+        self.executor.shutdown()
+
+# Bounded least-recently-used cache of OCR results. The same handful of names and ages come round again all day, so
+# each preprocessed image is fingerprinted (blake2b of its pixels, size and the tesseract config) and a repeat read is
+# a dictionary lookup instead of a tesseract call. When a path is given the entries are also kept in an sqlite table
+# so the cache survives a restart; the most recently used max_entries rows are loaded back at start-up
+class OCRResultCache:
+    def __init__(self, max_entries=256, path=None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()          # Maps each key to (text, confidence), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()          # Shared by the OCR thread and the pool's result callbacks
+        self.connection = None
+        if path:
+            # The cache is created on the main thread and used on the OCR thread, which the lock makes safe
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS OCRCache (key BLOB PRIMARY KEY, text TEXT, "
+                                    "confidence INTEGER, last_used REAL)")
+            rows = self.connection.execute("SELECT key, text, confidence FROM OCRCache ORDER BY last_used DESC "
+                                           "LIMIT ?", (max_entries,)).fetchall()
+            for key, text, confidence in reversed(rows):
+                self.entries[key] = (text, confidence)
+
+    # Returns the cache key of a preprocessed image read with a config
+    @staticmethod
+    def key(image, config=""):
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode} {image.size} {config}".encode())
+        return digest.digest()
+
+    # Returns the cached (text, confidence) for a key, or None, and counts the hit or miss
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    # Stores a result, dropping the least recently used entry once the cache is full
+    def put(self, key, text, confidence):
+        with self.lock:
+            self.entries[key] = (text, confidence)
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[0])
+            if self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO OCRCache VALUES (?, ?, ?, ?)",
+                                        (key, text, confidence, time.time()))
+                self.connection.executemany("DELETE FROM OCRCache WHERE key = ?", [(old,) for old in evicted])
+                self.connection.commit()
+
+    # Returns the percentage of lookups that were hits
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits * 100.0 / lookups if lookups else 0.0
+
+    # Returns a short summary of the hit rate and size for the debug panel
+    def summary(self):
+        return (f"OCR cache: {self.hit_rate():.0f}% hits ({self.hits}/{self.hits + self.misses}), "
+                f"{len(self.entries)}/{self.max_entries} entries")
+
+    # Saves the current recency order so the next start-up loads the right entries, then closes the database
+    def close(self):
+        with self.lock:
+            if not self.connection:
+                return
+            now = time.time()
+            # Later entries in the OrderedDict were used more recently, so they get the later timestamps
+            self.connection.executemany("UPDATE OCRCache SET last_used = ? WHERE key = ?",
+                                        [(now - len(self.entries) + index, key)
+                                         for index, key in enumerate(self.entries)])
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+# Reads short runs of digits in a fixed font without tesseract. The binarised region is split into glyphs at the
+# blank columns between them, each glyph is scaled to a glyph_size square and the set of them is correlated against
+# a learned atlas of digit templates with a single matrix product. The atlas starts empty and is filled from reads
+# tesseract was confident about, so after the first few patients the age field only needs tesseract when a glyph
+# matches nothing in the atlas well enough
+class DigitTemplateMatcher:
+    glyph_size = 20                           # Glyphs are compared as glyph_size x glyph_size squares
+    min_ink = 8                               # Column runs with fewer black pixels than this are specks, not glyphs
+
+    def __init__(self, min_score=0.9, templates_per_digit=4, max_digits=3):
+        self.min_score = min_score            # Lowest correlation a glyph may have with its best template
+        self.templates_per_digit = templates_per_digit
+        self.max_digits = max_digits          # More glyphs than this is not an age, so tesseract gets it
+        self.templates = np.zeros((0, self.glyph_size * self.glyph_size), dtype=np.float32)
+        self.labels = []                      # The digit each row of templates shows
+        self.last_score = None                # Worst glyph correlation of the last read, for the benchmark
+
+    # Splits a binarised image into glyphs and returns them as zero mean, unit length rows, or None when there is
+    # nothing that could be a digit. Glyphs that touch are not separated, so the read then falls back to tesseract
+    def glyphs(self, image):
+        pixels = np.asarray(image if image.mode == "L" else image.convert("L"))
+        ink = pixels < 128
+        columns = np.concatenate(([0], ink.any(axis=0).view(np.int8), [0]))
+        edges = np.diff(columns)
+        runs = [(start, end) for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+                if np.count_nonzero(ink[:, start:end]) >= self.min_ink]
+        if not runs or len(runs) > self.max_digits:
+            return None
+        size = self.glyph_size
+        vectors = np.zeros((len(runs), size, size), dtype=np.float32)
+        for index, (start, end) in enumerate(runs):
+            glyph = ink[:, start:end]
+            rows = np.flatnonzero(glyph.any(axis=1))
+            glyph = glyph[rows[0]:rows[-1] + 1]
+            height, width = glyph.shape
+            # Scaled to the square's height keeping its shape, so a 1 stays thin rather than being stretched into a bar
+            scaled_width = min(size, max(1, round(width * size / height)))
+            row_index = np.arange(size) * height // size
+            column_index = np.arange(scaled_width) * width // scaled_width
+            offset = (size - scaled_width) // 2
+            vectors[index, :, offset:offset + scaled_width] = glyph[row_index[:, None], column_index]
+        vectors = vectors.reshape(len(runs), -1)
+        vectors -= vectors.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        if not norms.all():
+            return None  # A solid block has no shape to match
+        return vectors / norms
+
+    # Returns the digits in the image, or None when the atlas cannot read every glyph with at least min_score
+    def read(self, image):
+        self.last_score = None
+        if not self.labels:
+            return None
+        vectors = self.glyphs(image)
+        if vectors is None:
+            return None
+        scores = vectors @ self.templates.T   # Correlation of every glyph with every template
+        best = scores.argmax(axis=1)
+        self.last_score = float(scores[np.arange(len(best)), best].min())
+        if self.last_score < self.min_score:
+            return None
+        return "".join(self.labels[index] for index in best)
+
+    # Adds the glyphs of an image tesseract read as text to the atlas. Only used when the glyph count matches the
+    # digits read, and a glyph is only stored when no template of its digit already matches it closely
+    def learn(self, image, text):
+        if not text.isdigit():
+            return
+        vectors = self.glyphs(image)
+        if vectors is None or len(vectors) != len(text):
+            return
+        for vector, digit in zip(vectors, text):
+            rows = [index for index, label in enumerate(self.labels) if label == digit]
+            if len(rows) >= self.templates_per_digit:
+                continue
+            if rows and (self.templates[rows] @ vector).max() >= 0.98:
+                continue
+            self.templates = np.vstack((self.templates, vector))
+            self.labels.append(digit)
+
+# Base class for OCR processors. Contains common image processing methods for OCR. The NumPy engine is used by
+# default and the original PIL chain is kept as process_image_pil, the reference implementation it is checked against
 class BaseOCRProcessor:
+    threshold = 128  # Defining the threshold for converting to binary image
+    upscale_factor = 3  # Factor to enlarge the image for improved OCR accuracy
+
+    shared_ocr_backend = None                 # OCR backend used by every processor not given its own
+    ocr_cache = None                          # Optional OCRResultCache shared by every processor
+    ocr_config = ""                           # Tesseract config the processor reads with
+
+    # The threshold mode is "otsu" by default so each frame picks its own threshold. The PIL engine always uses the
+    # fixed threshold
+    def __init__(self, engine="numpy", threshold_mode="otsu", ocr_backend=None):
+        self.engine = engine                  # "numpy" or "pil"
+        self.preprocessor = NumpyPreprocessor(self.threshold, self.upscale_factor, threshold_mode)
+        self.ocr_backend = ocr_backend
+
+    # Returns the (text, confidence) in a preprocessed image, from the OCR cache when this exact image has been read
+    # before. Processors share one backend, opened on the first read so that building the processors stays instant
+    # and never needs tesseract
+    def recognise(self, image, config=""):
+        cache = BaseOCRProcessor.ocr_cache
+        if cache is not None:
+            key = cache.key(image, config)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        if self.ocr_backend is None:
+            self.ocr_backend = BaseOCRProcessor.shared_backend()
+        text, confidence = self.ocr_backend.recognise(image, config)
+        if cache is not None:
+            cache.put(key, text, confidence)
+        return text, confidence
+
+    # Returns the backend shared by the processors, opening it the first time it is needed
+    @staticmethod
+    def shared_backend():
+        if BaseOCRProcessor.shared_ocr_backend is None:
+            BaseOCRProcessor.shared_ocr_backend = open_ocr_backend()
+        return BaseOCRProcessor.shared_ocr_backend
+
+    # Reads a list of (image, config) pairs with a single call to the shared backend (see recognise_batch) and returns
+    # their (text, confidence) results in order. Images already in the OCR cache are left out of the composite
+    @staticmethod
+    def recognise_batch(jobs):
+        cache = BaseOCRProcessor.ocr_cache
+        results = [None] * len(jobs)
+        keys = [None] * len(jobs)
+        if cache is not None:
+            for index, (image, config) in enumerate(jobs):
+                keys[index] = cache.key(image, config)
+                results[index] = cache.get(keys[index])
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            batch = BaseOCRProcessor.shared_backend().recognise_batch([jobs[index] for index in missing])
+            for index, result in zip(missing, batch):
+                results[index] = result
+                if cache is not None:
+                    cache.put(keys[index], *result)
+        return results
+
+    # Reads the region and returns its value. The reading is split into the tesseract call with ocr_config and
+    # parse_result, so the OCR worker pool can do the first part in another process and hand back the text
+    def process_ocr(self, screenshot, processed_image=None):
+        processed_image = self.prepare(screenshot, processed_image)
+        value = self.fast_read(processed_image)
+        if value is not None:
+            return value
+        text, confidence = self.recognise(processed_image, self.ocr_config)
+        self.learn(processed_image, text, confidence)
+        return self.parse_result(text)
+
+    # Turns the raw tesseract text into the region's value, or None if it is not a valid read
+    def parse_result(self, ocr_result):
+        return ocr_result.strip()
+
+    # Returns the region's value read without tesseract, or None when tesseract is needed. Nothing has a fast path by
+    # default
+    def fast_read(self, processed_image):
+        return None
+
+    # Called with every tesseract read so a fast path can learn from it
+    def learn(self, processed_image, text, confidence):
+        pass
+
     def process_image(self, screenshot):
+        if self.engine == "pil":
+            return self.process_image_pil(screenshot)
+        return self.preprocessor.process(screenshot)
+
+    # Returns the image tesseract should read. The live loop preprocesses each region once and hands the result to both
+    # the preview and process_ocr, so the preview is exactly what tesseract saw; anything else passes just the screenshot
+    def prepare(self, screenshot, processed_image=None):
+        if processed_image is None:
+            processed_image = self.process_image(screenshot)
+        return processed_image
+
+    # Reference implementation using a chain of PIL operations
+    def process_image_pil(self, screenshot):
         # Converts screenshot to grayscale
         image = screenshot.convert("L")
+        # Flips dark mode regions to dark text on a light background
+        dark_mode = self.preprocessor.stage("dark_mode")
+        if dark_mode.enabled and ImageStat.Stat(image).mean[0] < dark_mode.dark_level:
+            image = ImageOps.invert(image)
         width, height = image.size
-        upscale_factor = 3
+        upscale_factor = self.upscale_factor
         # Factor to enlarge the image for improved OCR accuracy. I chose three because it felt like a good middle ground.
         # Resize the image using high-quality Lanczos resampling
         image = image.resize((width * upscale_factor, height * upscale_factor), resample=Image.Resampling.LANCZOS)
-        threshold = 128  # Defining the threshold for converting to binary image
-        # Applying the thresholding which sets pixels below threshold to black and others to white
-        image = image.point(lambda x: 0 if x < threshold else 255, '1')
-        return image
+        return self.binarise(image)
+
+    # Applies the thresholding which sets pixels below threshold to black and others to white. Expects a grayscale image
+    def binarise(self, image):
+        threshold = self.threshold
+        return image.point(lambda x: 0 if x < threshold else 255, '1')
 
 # Derived OCR processor for reading the integer age data
 class AgeOCRProcessor(BaseOCRProcessor):
-    def process_ocr(self, screenshot):
-        processed_image = self.process_image(screenshot)  # Preprocess the image using the base class method above
-        custom_config = "--psm 7 -c tessedit_char_whitelist=0123456789"  # Tesseract config which ensures it only detects digits
-        ocr_result = pytesseract.image_to_string(processed_image, config=custom_config).strip()  # Perform the image OCR
+    ocr_config = "--psm 7 -c tessedit_char_whitelist=0123456789"  # Tesseract config which ensures it only detects digits
+    learn_confidence = 80                     # Tesseract reads less confident than this, or with no confidence at all,
+                                              # are not added to the atlas
+
+    # The ages are read by template matching once the matcher has learned the digits, set use_templates to False to
+    # always use tesseract
+    def __init__(self, engine="numpy", threshold_mode="otsu", ocr_backend=None, use_templates=True):
+        super().__init__(engine, threshold_mode, ocr_backend)
+        self.digit_matcher = DigitTemplateMatcher() if use_templates else None
+
+    def parse_result(self, ocr_result):
         try:
-            return int(ocr_result)  # Trys to convert the OCR result to an integer
+            return int(ocr_result.strip())  # Trys to convert the OCR result to an integer
         except ValueError:
             return None  # Return None if the conversion fails
 
+    def fast_read(self, processed_image):
+        if self.digit_matcher is None:
+            return None
+        digits = self.digit_matcher.read(processed_image)
+        return int(digits) if digits else None
+
+    def learn(self, processed_image, text, confidence):
+        if self.digit_matcher is not None and confidence is not None and confidence >= self.learn_confidence:
+            self.digit_matcher.learn(processed_image, text.strip())
+
 # Derived OCR processor for reading general text for the patient names
 class NameOCRProcessor(BaseOCRProcessor):
-    def process_ocr(self, screenshot):
-        processed_image = self.process_image(screenshot)  # Preprocess image using common method again
-        ocr_result = pytesseract.image_to_string(processed_image).strip()
-        # Perform OCR with default configuration so characters can be recognized too
-        return ocr_result  # Return the extracted text
+    ocr_config = ""  # Default configuration so characters can be recognized too
+
+    def parse_result(self, ocr_result):
+        return ocr_result.strip()  # Return the extracted text
+
+# Checks the NHS number check digit (modulus 11 over the first nine digits weighted 10 down to 2)
+def nhs_number_is_valid(digits):
+    total = sum(int(digit) * weight for digit, weight in zip(digits[:9], range(10, 1, -1)))
+    check_digit = 11 - total % 11
+    if check_digit == 11:
+        check_digit = 0
+    return check_digit != 10 and check_digit == int(digits[9])
+
+# Derived OCR processor for reading the 10 digit NHS number, which is returned in the usual "485 777 3456" layout
+class NHSNumberOCRProcessor(BaseOCRProcessor):
+    ocr_config = "--psm 7 -c tessedit_char_whitelist=0123456789"  # Only digits, the spaces are dropped below
+
+    def parse_result(self, ocr_result):
+        digits = "".join(character for character in ocr_result if character.isdigit())
+        # Anything that is not exactly ten digits with a valid check digit is treated as a failed read
+        if len(digits) != 10 or not nhs_number_is_valid(digits):
+            return None
+        return f"{digits[:3]} {digits[3:6]} {digits[6:]}"
+
+# Derived OCR processor for reading a date of birth such as 02/03/1950 or 02-Mar-1950
+class DateOCRProcessor(BaseOCRProcessor):
+    date_formats = ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d-%b-%Y", "%d %b %Y")  # Layouts used by the EHR systems
+    ocr_config = "--psm 7"
+
+    def parse_result(self, ocr_result):
+        ocr_result = ocr_result.strip()
+        for date_format in self.date_formats:
+            try:
+                return datetime.strptime(ocr_result, date_format).strftime("%d/%m/%Y")
+            except ValueError:
+                continue
+        return None  # Return None if no date layout matches
+
+# Derived OCR processor for reading an appointment time such as 14:30
+class TimeOCRProcessor(BaseOCRProcessor):
+    ocr_config = "--psm 7 -c tessedit_char_whitelist=0123456789:"
+
+    def parse_result(self, ocr_result):
+        try:
+            return datetime.strptime(ocr_result.strip(), "%H:%M").strftime("%H:%M")
+        except ValueError:
+            return None
+
+# Base class for capture backends. A backend hands out PIL images of the screen, or of something standing in for it,
+# so the rest of the program never needs to know where the pixels actually came from
+class BaseCaptureBackend:
+    # Returns the (width, height) of a full frame from this backend
+    def size(self):
+        return self.screenshot().size
+
+    # Returns a PIL image of the (x, y, width, height) region, or of the whole frame if no region is given
+    def screenshot(self, region=None):
+        raise NotImplementedError
+
+    # Returns the region as a FrameBuffer. Backends with direct access to the pixels override this to skip PIL
+    def capture_frame(self, region=None):
+        return FrameBuffer.from_image(self.screenshot(region))
+
+# Captures the live screen through pyautogui. This is the default backend used by the application
+class ScreenCaptureBackend(BaseCaptureBackend):
+    def __init__(self):
+        # Imported here rather than at the top so the replay backends work on machines without a display
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def size(self):
+        return tuple(self.pyautogui.size())
+
+    def screenshot(self, region=None):
+        return self.pyautogui.screenshot(region=region)
+
+# ctypes layouts of the Xlib structures used by XShmCaptureBackend, copied from X11/Xlib.h and X11/extensions/XShm.h
+class XImageFuncs(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_void_p) for name in
+                ("create_image", "destroy_image", "get_pixel", "put_pixel", "sub_image", "add_pixel")]
+
+class XImage(ctypes.Structure):
+    _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int),
+                ("format", ctypes.c_int), ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int), ("bitmap_pad", ctypes.c_int),
+                ("depth", ctypes.c_int), ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int),
+                ("red_mask", ctypes.c_ulong), ("green_mask", ctypes.c_ulong), ("blue_mask", ctypes.c_ulong),
+                ("obdata", ctypes.c_void_p), ("f", XImageFuncs)]
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int), ("shmaddr", ctypes.c_void_p),
+                ("readOnly", ctypes.c_int)]
+
+# Captures the screen straight from the X server on Linux. With the MIT shared memory extension (XShm) the server
+# writes the pixels into a memory segment shared with this process, so there is no external screenshot tool, no
+# temporary file and no PNG encode/decode. If the extension is unavailable (e.g. a remote display) it falls back to
+# a plain XGetImage, which is still far quicker than pyautogui for small regions
+class XShmCaptureBackend(BaseCaptureBackend):
+    ZPixmap = 2                               # XImage format holding packed pixels
+    AllPlanes = ctypes.c_ulong(-1).value      # Plane mask that reads every bit plane
+    IPC_PRIVATE, IPC_CREAT, IPC_RMID = 0, 0o1000, 0  # System V shared memory constants
+
+    def __init__(self, display_name=None):
+        self.xlib = self.load_library("X11")
+        self.xext = self.load_library("Xext")
+        self.libc = self.load_library("c")
+        self.declare_functions()
+        self.display = self.xlib.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self.display:
+            raise OSError("Could not open the X display")
+        screen = self.xlib.XDefaultScreen(self.display)
+        self.root = self.xlib.XDefaultRootWindow(self.display)
+        self.visual = self.xlib.XDefaultVisual(self.display, screen)
+        self.depth = self.xlib.XDefaultDepth(self.display, screen)
+        self.screen_size = (self.xlib.XDisplayWidth(self.display, screen), self.xlib.XDisplayHeight(self.display, screen))
+        self.use_shm = bool(self.xext.XShmQueryExtension(self.display))
+        self.shm_image = None                 # Shared memory image, reused while the captured size stays the same
+        self.shm_info = None
+        # The OCR thread and the region selector on the GUI thread both capture through the one Display connection and
+        # shared memory image, and Xlib is not initialised for threads, so only one read may run at a time
+        self.lock = threading.Lock()
+
+    # Loads a native library by its short name, raising OSError if it is not installed
+    @staticmethod
+    def load_library(name):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            raise OSError(f"lib{name} not found")
+        return ctypes.CDLL(path)
+
+    # Declares the argument and return types so ctypes passes 64 bit pointers and longs correctly
+    def declare_functions(self):
+        xlib, xext, libc = self.xlib, self.xext, self.libc
+        image_pointer = ctypes.POINTER(XImage)
+        shm_info_pointer = ctypes.POINTER(XShmSegmentInfo)
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultVisual.restype = ctypes.c_void_p
+        xlib.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XGetImage.restype = image_pointer
+        xlib.XGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+                                   ctypes.c_uint, ctypes.c_ulong, ctypes.c_int]
+        xlib.XDestroyImage.argtypes = [image_pointer]
+        xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = image_pointer
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_char_p, shm_info_pointer, ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, shm_info_pointer]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, shm_info_pointer]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, image_pointer, ctypes.c_int, ctypes.c_int,
+                                      ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def size(self):
+        return self.screen_size
+
+    # Makes sure the shared memory image matches the requested size, recreating it only when the size changes
+    def prepare_shm_image(self, width, height):
+        image = self.shm_image
+        if image and image.contents.width == width and image.contents.height == height:
+            return image
+        self.release_shm_image()
+        shm_info = XShmSegmentInfo()
+        image = self.xext.XShmCreateImage(self.display, self.visual, self.depth, self.ZPixmap, None,
+                                          ctypes.byref(shm_info), width, height)
+        if not image:
+            raise OSError("XShmCreateImage failed")
+        shm_info.shmid = self.libc.shmget(self.IPC_PRIVATE, image.contents.bytes_per_line * height,
+                                          self.IPC_CREAT | 0o600)
+        if shm_info.shmid < 0:
+            raise OSError("shmget failed")
+        shm_info.shmaddr = self.libc.shmat(shm_info.shmid, None, 0)
+        image.contents.data = shm_info.shmaddr
+        shm_info.readOnly = 0
+        self.xext.XShmAttach(self.display, ctypes.byref(shm_info))
+        self.xlib.XSync(self.display, 0)
+        self.libc.shmctl(shm_info.shmid, self.IPC_RMID, None)  # The segment is freed once both sides detach
+        self.shm_image, self.shm_info = image, shm_info
+        return image
+
+    # Detaches and frees the shared memory image, if there is one
+    def release_shm_image(self):
+        if self.shm_image:
+            self.xext.XShmDetach(self.display, ctypes.byref(self.shm_info))
+            self.xlib.XSync(self.display, 0)
+            self.libc.shmdt(self.shm_info.shmaddr)
+            self.shm_image.contents.data = None  # The data belongs to the segment, so Xlib must not free it
+            self.xlib.XDestroyImage(self.shm_image)
+            self.shm_image = self.shm_info = None
+
+    # Reads the region into an XImage and calls consume(image) with it while its pixel memory is still valid
+    def read_region(self, region, consume):
+        x, y, width, height = region or ((0, 0) + self.screen_size)
+        with self.lock:
+            if self.use_shm:
+                image = self.prepare_shm_image(width, height)
+                if not self.xext.XShmGetImage(self.display, self.root, image, x, y, self.AllPlanes):
+                    raise OSError("XShmGetImage failed")
+                return consume(image.contents)
+            image = self.xlib.XGetImage(self.display, self.root, x, y, width, height, self.AllPlanes, self.ZPixmap)
+            if not image:
+                raise OSError("XGetImage failed")
+            try:
+                return consume(image.contents)
+            finally:
+                self.xlib.XDestroyImage(image)
+
+    # Returns the raw pixel layout of an XImage as a PIL raw mode. Nearly every X server uses 32 bit BGRX
+    @staticmethod
+    def raw_mode(image):
+        if image.bits_per_pixel != 32:
+            raise OSError(f"Unsupported X visual with {image.bits_per_pixel} bits per pixel")
+        return "BGRX" if image.red_mask == 0xFF0000 else "RGBX"
+
+    # Returns the region's pixels as (bytes, (width, height), bytes_per_line, raw_mode) without any image encoding
+    def raw_screenshot(self, region=None):
+        def copy_pixels(image):
+            data = ctypes.string_at(image.data, image.bytes_per_line * image.height)
+            return data, (image.width, image.height), image.bytes_per_line, self.raw_mode(image)
+        return self.read_region(region, copy_pixels)
+
+    # Copies the region straight out of the X server's memory into a FrameBuffer, which pygame can display as is
+    def capture_frame(self, region=None):
+        data, size, bytes_per_line, raw_mode = self.raw_screenshot(region)
+        return FrameBuffer(data, size, raw_mode, bytes_per_line)
+
+    def screenshot(self, region=None):
+        def decode_pixels(image):
+            # PIL unpacks BGRX into RGB straight out of the X server's memory, so this is the only copy made
+            buffer = (ctypes.c_char * (image.bytes_per_line * image.height)).from_address(image.data)
+            return Image.frombuffer("RGB", (image.width, image.height), buffer, "raw", self.raw_mode(image),
+                                    image.bytes_per_line, 1)
+        return self.read_region(region, decode_pixels)
+
+    # Frees the shared memory and closes the connection to the X server
+    def close(self):
+        with self.lock:
+            self.release_shm_image()
+            if self.display:
+                self.xlib.XCloseDisplay(self.display)
+                self.display = None
+
+# Replays a folder of images (or a single image file) as if it were the screen. Every call to screenshot() consumes one
+# frame and the sequence loops forever, so a folder such as darkmode/ can drive the pipeline on a headless machine
+class DirectoryCaptureBackend(BaseCaptureBackend):
+    extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')  # Same image types that dark to light mode.py accepts
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            self.paths = [os.path.join(path, file_name) for file_name in sorted(os.listdir(path))
+                          if file_name.lower().endswith(self.extensions)]
+        else:
+            self.paths = [path]               # A single file such as test_age.png is replayed on its own
+        if not self.paths:
+            raise ValueError(f"No images found in {path}")
+        self.frames = {}                      # Decoded frames are cached so replays run at full speed
+        self.index = 0                        # Position of the next frame to hand out
+
+    # Loads (once) and returns the frame at the given position as an RGB PIL image
+    def frame(self, index):
+        if index not in self.frames:
+            with Image.open(self.paths[index]) as img:
+                self.frames[index] = img.convert("RGB")
+        return self.frames[index]
+
+    def size(self):
+        return self.frame(self.index).size
+
+    def screenshot(self, region=None):
+        frame = self.frame(self.index)
+        self.index = (self.index + 1) % len(self.paths)  # Moves on to the next frame, wrapping around at the end
+        if region is None:
+            return frame.copy()
+        x, y, w, h = region
+        return frame.crop((x, y, x + w, y + h))
+
+# Picks a capture backend for a source given on the command line. No source means the live screen, read through X11
+# shared memory on Linux when it is available and through pyautogui everywhere else
+def open_capture_backend(source=None):
+    if source == "screen":
+        return ScreenCaptureBackend()
+    if source == "xshm":
+        return XShmCaptureBackend()
+    if source is None:
+        if sys.platform.startswith("linux") and os.environ.get("DISPLAY"):
+            try:
+                return XShmCaptureBackend()
+            except OSError as error:
+                print(f"X11 capture unavailable ({error}), falling back to pyautogui.")
+        return ScreenCaptureBackend()
+    if os.path.isfile(source) and SessionReplay.is_recording(source):
+        return SessionCaptureBackend(source)
+    return DirectoryCaptureBackend(source)
+
+# Class that captures the screen once per OCR tick and slices every registered region out of that single frame.
+# Taking one capture instead of one per region halves the capture cost at two regions, keeps it flat as more fields
+# are added, and guarantees that the age and name crops both come from the same moment in time
+class FrameGrabber:
+    def __init__(self, backend):
+        self.backend = backend                # Capture backend that frames are taken from
+        self.regions = {}                     # Maps each region name to its (x, y, width, height) rectangle
+
+    # Registers a named region (or moves it if the name is already registered)
+    def register(self, name, rect):
+        self.regions[name] = rect
+
+    # Removes a named region so it is no longer captured
+    def unregister(self, name):
+        self.regions.pop(name, None)
+
+    # Returns the smallest (x, y, width, height) rectangle covering the named regions (all of them by default), or None
+    # if there are none
+    def bounding_box(self, names=None):
+        rects = [self.regions[name] for name in (self.regions if names is None else names)]
+        if not rects:
+            return None
+        left = min(x for x, y, w, h in rects)
+        top = min(y for x, y, w, h in rects)
+        right = max(x + w for x, y, w, h in rects)
+        bottom = max(y + h for x, y, w, h in rects)
+        return (left, top, right - left, bottom - top)
+
+    # Captures one frame covering the named regions (all of them by default) and returns a dictionary of PIL crops
+    # keyed by region name
+    def grab(self, names=None):
+        names = list(self.regions if names is None else names)
+        bbox = self.bounding_box(names)
+        if bbox is None:
+            return {}
+        frame = self.backend.screenshot(region=bbox)  # The only capture round-trip for this tick
+        left, top = bbox[0], bbox[1]
+        crops = {}
+        for name in names:
+            x, y, w, h = self.regions[name]
+            # Offsets are relative to the captured bounding box rather than the whole screen
+            crops[name] = frame.crop((x - left, y - top, x - left + w, y - top + h))
+        return crops
+
+# Class that remembers a cheap digest of each region's raw pixels so unchanged regions can skip preprocessing and OCR.
+# A hit means the region was identical to the previous tick and the OCR work was skipped, a miss means it changed
+class RegionChangeDetector:
+    def __init__(self):
+        self.digests = {}                     # Last seen digest for each region name
+        self.stats = {}                       # Hit and miss counters for each region name
+
+    # Returns a short digest of the raw region bytes. blake2b is much faster than sha256 for this and 16 bytes is plenty
+    def fingerprint(self, name, image):
+        return hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+
+    # Decides whether two fingerprints of the same region count as the same content
+    def is_same(self, old, new):
+        return old == new
+
+    # Returns True if the region differs from the last time it was seen, and updates the counters
+    def has_changed(self, name, image):
+        digest = self.fingerprint(name, image)
+        counters = self.stats.setdefault(name, {"hits": 0, "misses": 0})
+        if name in self.digests and self.is_same(self.digests[name], digest):
+            counters["hits"] += 1
+            return False
+        self.digests[name] = digest
+        counters["misses"] += 1
+        return True
+
+    # Forgets the stored digests so the next tick OCRs every region again. The counters are kept
+    def reset(self):
+        self.digests.clear()
+
+    # Returns a short "name: skipped%" summary of the counters for the debug panel
+    def summary(self):
+        parts = []
+        for name, counters in self.stats.items():
+            total = counters["hits"] + counters["misses"]
+            parts.append(f"{name}: {counters['hits']}/{total} skipped")
+        return "  ".join(parts)
+
+# Change detector that tolerates repaints such as slightly different anti-aliasing or colours. Each region is run
+# through its OCR processor's own pipeline up to the threshold stage, so the fingerprint uses the same dark mode
+# handling and the same Otsu or adaptive threshold decision as the OCR read, and keeps even a one pixel stroke of
+# small screen text. A repaint that does not move any pixel across that threshold gives the same fingerprint.
+# Fingerprints are compared exactly by default: in 11-14px text, i to l differs by only two pixels on the edge of a
+# stroke, which is no different from jitter. A max_distance above 0 lets the odd pixel through for larger text, as
+# long as no grid cell gains or loses more than cell_tolerance of them.
+# A blinking caret is not ignored, as it looks just like a thin letter (l, I, i) being typed or deleted. Each blink
+# alternates between the same two images though, so the OCR result cache answers it without running tesseract
+class PerceptualChangeDetector(RegionChangeDetector):
+    cell_size = 4                             # Changed pixels are counted in 4x4 blocks of screen pixels
+    cell_tolerance = 1                        # Most changed pixels a block may have and still count as jitter
+
+    def __init__(self, processors, max_distance=0):
+        super().__init__()
+        self.processors = processors          # Maps region name to the OCR processor whose thresholding is reused
+        self.max_distance = max_distance      # Most changed pixels in the whole region still treated as unchanged
+
+    # Regions without a processor fall back to the exact digest from the base class. Otherwise returns a boolean array
+    # that is True where the region has ink. The pipeline memoises the stages it ran, so the OCR read of a changed
+    # region starts from the thresholded image instead of doing those stages again
+    def fingerprint(self, name, image):
+        processor = self.processors.get(name)
+        if processor is None:
+            return super().fingerprint(name, image)
+        return processor.preprocessor.run(image, last="threshold") == 0
+
+    def is_same(self, old, new):
+        if isinstance(old, bytes) or isinstance(new, bytes):
+            return old == new
+        if old.shape != new.shape:
+            return False  # The region was reselected
+        changed = old ^ new
+        total = np.count_nonzero(changed)
+        if total == 0:
+            return True
+        if total > self.max_distance:
+            return False
+        size = self.cell_size
+        cells = np.add.reduceat(np.add.reduceat(changed.view(np.uint8), np.arange(0, changed.shape[0], size), axis=0),
+                                np.arange(0, changed.shape[1], size), axis=1)
+        return cells.max() <= self.cell_tolerance
+
+# Decides how long the OCR thread waits before polling the screen again. Straight after a change it polls at the
+# minimum interval so a new patient gets a colour almost immediately, and every idle poll doubles the wait up to the
+# maximum interval so a screen that is not changing costs very little CPU
+class AdaptiveScheduler:
+    def __init__(self, min_interval=0.1, max_interval=0.5, backoff=2.0):
+        self.min_interval = min_interval      # Seconds between polls while the screen is changing
+        self.max_interval = max_interval      # Longest wait between polls while the screen is idle
+        self.backoff = backoff                # Factor the wait grows by after every idle poll
+        self.interval = min_interval
+
+    # Returns the number of seconds to wait before the next poll, given whether the last poll saw a change
+    def next_interval(self, changed):
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+    # Goes back to polling at the fastest rate, used whenever OCR is switched on
+    def reset(self):
+        self.interval = self.min_interval
+
+# A named area of the screen that is read by its own OCR processor. Regions with a higher priority are read first in
+# each tick, and a region is read at most once every poll_interval seconds however often the screen is polled
+class CaptureRegion:
+    def __init__(self, name, label, processor, poll_interval=0.0, priority=0, required=False):
+        self.name = name                      # Key used by the frame grabber, change detector and results
+        self.label = label                    # Text used on the select button, preview placeholder and output window
+        self.processor = processor            # OCR processor that turns the region into a value
+        self.poll_interval = poll_interval    # Minimum seconds between two reads of this region
+        self.priority = priority              # Higher priority regions are read first
+        self.required = required              # OCR cannot start until every required region has been selected
+        self.rect = None                      # Coordinates of the selected area
+        self.image = None                     # Pygame image for the preview
+        self.result = None                    # Latest OCR result, kept while the region is unchanged
+        self.last_read = 0.0                  # time.monotonic() of the last time this region was captured
+        self.button_rect = None               # Select button, positioned by the App
+        self.preview_area = None              # Preview area, positioned by the App
+
+# Keeps every capture region in the order they were added and hands them out by name or by priority
+class RegionRegistry:
+    def __init__(self):
+        self.regions = {}
+
+    # Adds a region and returns it
+    def add(self, region):
+        self.regions[region.name] = region
+        return region
+
+    def get(self, name):
+        return self.regions[name]
+
+    def __iter__(self):
+        return iter(self.regions.values())
+
+    # Returns the regions that must be selected before OCR can start
+    def required(self):
+        return [region for region in self if region.required]
+
+    # Returns every region that has been selected, highest priority first
+    def selected(self):
+        return sorted((region for region in self if region.rect), key=lambda region: region.priority, reverse=True)
+
+    # Returns the selected regions whose poll interval has elapsed at the given time, highest priority first
+    def due(self, now):
+        return [region for region in self.selected() if now - region.last_read >= region.poll_interval]
+
+# Builds the registry of every region the application reads, each with its own OCR processor
+def build_region_registry():
+    regions = RegionRegistry()
+    regions.add(CaptureRegion("age", "Age", AgeOCRProcessor(), priority=10, required=True))
+    regions.add(CaptureRegion("name", "Name", NameOCRProcessor(), priority=10, required=True))
+    regions.add(CaptureRegion("nhs_number", "NHS No.", NHSNumberOCRProcessor(), priority=5))
+    regions.add(CaptureRegion("dob", "DOB", DateOCRProcessor(), priority=5))
+    regions.add(CaptureRegion("appointment", "Appointment", TimeOCRProcessor(), poll_interval=2.0, priority=1))
+    return regions
+
+# Records every region the OCR loop captures into one memory-mapped file, so field OCR failures can be reproduced from
+# the exact pixels that were seen. The file starts with a magic string and is followed by records of
+# (timestamp, mode, width, height, name length), the region name and the raw pixels. It grows in fixed size chunks
+# that are mapped into memory, and a region identical to its previous record is skipped
+class SessionRecorder:
+    magic = b"NHSREC1\0"
+    record_header = struct.Struct("<d4sIIH")  # timestamp, PIL mode, width, height, length of the region name
+    chunk_size = 4 * 1024 * 1024              # The file grows 4 MiB at a time
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w+b")
+        self.file.truncate(self.chunk_size)
+        self.map = mmap.mmap(self.file.fileno(), self.chunk_size)
+        self.map[:len(self.magic)] = self.magic
+        self.position = len(self.magic)       # Where the next record will be written
+        self.last_digests = {}                # Digest of the last record written for each region
+        self.records_written = 0
+        self.duplicates_skipped = 0
+
+    # Maps more of the file whenever the next record would not fit in what is already mapped
+    def reserve(self, length):
+        if self.position + length <= len(self.map):
+            return
+        chunks = (self.position + length) // self.chunk_size + 1
+        self.map.close()
+        self.file.truncate(chunks * self.chunk_size)
+        self.map = mmap.mmap(self.file.fileno(), chunks * self.chunk_size)
+
+    # Appends one captured region unless it is identical to the previous one recorded for the same name
+    def record(self, name, image, timestamp=None):
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGB")
+        pixels = image.tobytes()
+        digest = hashlib.blake2b(pixels, digest_size=16).digest()
+        if self.last_digests.get(name) == digest:
+            self.duplicates_skipped += 1
+            return False
+        self.last_digests[name] = digest
+        encoded_name = name.encode("utf-8")
+        header = self.record_header.pack(timestamp if timestamp is not None else time.time(),
+                                         image.mode.encode("ascii"), image.width, image.height, len(encoded_name))
+        length = len(header) + len(encoded_name) + len(pixels)
+        self.reserve(length)
+        start = self.position
+        self.map[start:start + len(header)] = header
+        start += len(header)
+        self.map[start:start + len(encoded_name)] = encoded_name
+        start += len(encoded_name)
+        self.map[start:start + len(pixels)] = pixels
+        self.position = start + len(pixels)
+        self.records_written += 1
+        return True
+
+    # Flushes the recording and trims the unused end of the last chunk
+    def close(self):
+        if self.map is None:
+            return
+        self.map.flush()
+        self.map.close()
+        self.map = None
+        self.file.truncate(self.position)
+        self.file.close()
+
+# Reads a file written by SessionRecorder. The whole file is memory mapped and every region image is created with
+# Image.frombuffer straight on the mapping, so replaying does not copy or decode anything up front
+class SessionReplay:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(SessionRecorder.magic)] != SessionRecorder.magic:
+            raise ValueError(f"{path} is not a session recording")
+
+    # Returns True if the file starts with the SessionRecorder magic string
+    @staticmethod
+    def is_recording(path):
+        with open(path, "rb") as file:
+            return file.read(len(SessionRecorder.magic)) == SessionRecorder.magic
+
+    # Yields (timestamp, region name, mode, size, offset of the pixels) for every record in the order they were
+    # captured, reading only the headers
+    def records(self):
+        header = SessionRecorder.record_header
+        position = len(SessionRecorder.magic)
+        while position + header.size <= len(self.map):
+            timestamp, mode, width, height, name_length = header.unpack_from(self.map, position)
+            if name_length == 0:
+                break                         # Zero filled space left by a recording that was not closed
+            position += header.size
+            name = self.map[position:position + name_length].decode("utf-8")
+            position += name_length
+            mode = mode.rstrip(b"\0").decode("ascii")
+            yield timestamp, name, mode, (width, height), position
+            position += width * height * FrameBuffer.bytes_per_pixel[mode]
+
+    # Returns the region image whose pixels start at the given offset, made straight on the mapping
+    def image(self, mode, size, offset):
+        length = size[0] * size[1] * FrameBuffer.bytes_per_pixel[mode]
+        return Image.frombuffer(mode, size, memoryview(self.map)[offset:offset + length], "raw", mode, 0, 1)
+
+    # Yields (timestamp, region name, PIL image) for every record in the order they were captured
+    def __iter__(self):
+        for timestamp, name, mode, size, offset in self.records():
+            yield timestamp, name, self.image(mode, size, offset)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+# Replays a session recorded with --record as if it were the screen, so the recording can drive the whole capture ->
+# OCR -> database pipeline through --source. The recording only holds the regions, so each tick's regions are laid
+# out one under the other on a white frame and region_rects says where each one went. Every region captured in the
+# same OCR tick is stamped with the same timestamp, so a new timestamp starts the next frame, and a region left out of
+# a tick because it had not changed keeps its last image. Opening a recording only reads the record headers: a frame
+# is built from the mapping when it is handed out and only the latest one is kept, so long sessions replay in little
+# memory. Frames loop forever just like the directory backend
+class SessionCaptureBackend(DirectoryCaptureBackend):
+    def __init__(self, path):
+        self.replay = SessionReplay(path)     # Kept open for the life of the backend, frames are built from it
+        self.ticks = []                       # For each tick, (mode, size, offset) of the latest record of each region
+        latest = {}
+        sizes = {}                            # Largest size each region was recorded at
+        tick_time = None
+        for timestamp, name, mode, size, offset in self.replay.records():
+            if timestamp != tick_time and latest:
+                self.ticks.append(dict(latest))
+            tick_time = timestamp
+            latest[name] = (mode, size, offset)
+            width, height = sizes.get(name, (0, 0))
+            sizes[name] = (max(width, size[0]), max(height, size[1]))
+        if not latest:
+            self.replay.close()
+            raise ValueError(f"No regions recorded in {path}")
+        self.ticks.append(latest)
+        self.region_rects = {}                # Where each recorded region is placed on the replayed frames
+        top = 0
+        for name, (width, height) in sizes.items():
+            self.region_rects[name] = (0, top, width, height)
+            top += height
+        self.frame_size = (max(width for width, _ in sizes.values()), top)
+        self.frames = {}                      # Holds only the frame built last, keyed by its index
+        self.paths = [path] * len(self.ticks)  # One entry per frame so the frame counting above still works
+        self.index = 0
+
+    # Builds the frame for a tick by pasting each region's record from the mapping onto a white frame
+    def frame(self, index):
+        if index not in self.frames:
+            frame = Image.new("RGB", self.frame_size, "white")
+            for name, (mode, size, offset) in self.ticks[index].items():
+                frame.paste(self.replay.image(mode, size, offset), self.region_rects[name][:2])
+            self.frames = {index: frame}
+        return self.frames[index]
+
+    def close(self):
+        self.frames = {}
+        self.replay.close()
+
+# Feeds a recorded session back through the OCR processors as fast as possible and reports the results and timing.
+# Regions without a matching processor are skipped
+def replay_session(path, processors):
+    replay = SessionReplay(path)
+    timings = {}
+    image = None
+    start_time = time.perf_counter()
+    for timestamp, name, image in replay:
+        processor = processors.get(name)
+        if processor is None:
+            continue
+        read_start = time.perf_counter()
+        result = processor.process_ocr(image)
+        timings.setdefault(name, []).append(time.perf_counter() - read_start)
+        print(f"{datetime.fromtimestamp(timestamp):%H:%M:%S.%f} {name}: {result!r}")
+    elapsed = time.perf_counter() - start_time
+    image = None                              # Releases the last view into the mapping so it can be closed
+    replay.close()
+    for name, region_timings in timings.items():
+        print(f"{name}: {len(region_timings)} reads, {sum(region_timings) / len(region_timings) * 1000:.1f} ms each")
+    print(f"Replayed in {elapsed:.3f}s")
+    return timings
 
 # Class to enable user to select a screen region interactively with a screenshot like interface
 class ScreenshotSelector:
     # Allows user to define a region on the screen via mouse dragging
-    def __init__(self):
+    def __init__(self, backend):
+        self.backend = backend     # Capture backend used for the background screenshot
         self.selected_rect = None  # Initializes the variable to store the selected rectangle
 
     def select_area(self):
-        screen_width, screen_height = pyautogui.size()  # Get full screen dimensions
-        full_screen_pil = pyautogui.screenshot()          # Capture a full-screen screenshot which is a PIL image
-        mode = full_screen_pil.mode                       # Get image mode
-        size = full_screen_pil.size                       # Get image size
-        data = full_screen_pil.tobytes()                  # Get raw image data
-        background = pygame.image.fromstring(data, size, mode)  # Create a pygame surface from the screenshot
+        screen_width, screen_height = self.backend.size()  # Get full screen dimensions
+        full_screen = self.backend.capture_frame()          # Capture a full-screen screenshot into a FrameBuffer
+        background = full_screen.to_surface()  # Create a pygame surface sharing the screenshot's memory
         # Creates a fullscreen pygame window to allow the user to select with mouse
-        full_screen = pygame.display.set_mode((screen_width, screen_height), pygame.FULLSCREEN)
-        full_screen.blit(background, (0, 0))  # Displays the screenshot as background
+        window = pygame.display.set_mode((screen_width, screen_height), pygame.FULLSCREEN)
+        window.blit(background, (0, 0))  # Displays the screenshot as background
         pygame.display.flip()
         selecting = True
         start_pos = None  # Variable that stores the starting mouse position
@@ -125,13 +1963,13 @@ class ScreenshotSelector:
                     start_pos = event.pos  # Records the starting position on mouse down which is left mouse button
                 if event.type == pygame.MOUSEMOTION and start_pos:
                     current_pos = event.pos  # This is the current mouse position during drag
-                    full_screen.blit(background, (0, 0))  # Redraws the background
+                    window.blit(background, (0, 0))  # Redraws the background
                     x = min(start_pos[0], current_pos[0])  # Determines rectangle x coordinate
                     y = min(start_pos[1], current_pos[1])  # Determines rectangle y coordinate
                     width = abs(current_pos[0] - start_pos[0])  # Determines rectangle width
                     height = abs(current_pos[1] - start_pos[1])  # Determines rectangle height
                     rect = pygame.Rect(x, y, width, height)
-                    pygame.draw.rect(full_screen, (255, 0, 0), rect, 2)  # Draws a red rectangle for selection
+                    pygame.draw.rect(window, (255, 0, 0), rect, 2)  # Draws a red rectangle for selection
                     pygame.display.flip()
                 if event.type == pygame.MOUSEBUTTONUP and event.button == 1 and start_pos:
                     end_pos = event.pos  # Gets the ending mouse position on release of the left mouse button
@@ -142,25 +1980,30 @@ class ScreenshotSelector:
                     self.selected_rect = (x1, y1, x2 - x1, y2 - y1)  # Stores the selected region dimensions
                     selecting = False  # Ends the selection loop
                     break
-        selected_image = pyautogui.screenshot(region=self.selected_rect)  # Captures the selected screen region
+        # Crops the selected region out of the screenshot already taken instead of capturing the screen a second time
+        selected_image = full_screen.crop(self.selected_rect).to_image()
         return self.selected_rect, selected_image  # Returns the region and its image
 
 # Main application class that integrates the GUI, OCR processing, and database interactions all together
 class App:
-    # Initializes the main application window and variables
-    def __init__(self):
+    # Initializes the main application window and variables. The capture backend defaults to the live screen and the
+    # change detection can be "perceptual" (ignores caret blink and anti-aliasing) or "exact" (any pixel difference)
+    def __init__(self, capture_backend=None, change_detection="perceptual", scheduler=None, ocr_pool=None,
+                 batch_ocr=False, database=None):
         self.width = 1150                     # Width of the pygame window
-        self.height = 400                     # Height of the pygame window
+        self.height = 600                     # Height of the pygame window
         self.screen = pygame.display.set_mode((self.width, self.height)) # Setting the resolution of the screen
         pygame.display.set_caption("Screenshot Selector") # The name of the pygame window
         self.clock = pygame.time.Clock()      # Clock to manage frame rate
         self.running = True                   # Flag to keep the main loop running
 
-        self.age_rect = None                  # Coordinates for the age area selection
-        self.age_image = None                 # Pygame image for the age preview
-        self.name_rect = None                 # Coordinates for the name area selection
-        self.name_image = None                # Pygame image for the name preview
+        # Registry of every screen region that is read. Age and name are needed for the vaccine colour, the others are
+        # optional extras shown in the output window when they have been selected
+        self.regions = build_region_registry()
 
+        self.ocr_stop_event = threading.Event()  # Set while OCR is stopped, and wakes the worker as soon as it is set
+        self.ocr_thread = None                # The single OCR worker thread, if one has been started
+        self.ocr_thread_lock = threading.Lock()  # Stops two clicks racing each other into starting two workers
         self.ocr_active = False               # Flag to control OCR processing
         self.latest_ocr_number = None         # Stores the latest OCR result for age
         self.latest_patient_name = None       # Stores the latest OCR result for name
@@ -177,14 +2020,19 @@ class App:
         self.font = pygame.font.SysFont('Arial', 16)  # Font for rendering text in pygame which is never changed
 
         # Defining the buttons with their positions and dimensions
-        self.select_age_button_rect = pygame.Rect(50, 20, 200, 40)
-        self.select_name_button_rect = pygame.Rect(300, 20, 200, 40)
+        self.regions.get("age").button_rect = pygame.Rect(50, 20, 200, 40)
+        self.regions.get("name").button_rect = pygame.Rect(300, 20, 200, 40)
         self.ocr_button_rect = pygame.Rect(550, 20, 200, 40)
         self.spawn_output_button_rect = pygame.Rect(800, 20, 200, 40)
 
         # Defining the preview areas for displaying selected images
-        self.age_preview_area = pygame.Rect(50, 80, 500, 250)
-        self.name_preview_area = pygame.Rect(600, 80, 500, 250)
+        self.regions.get("age").preview_area = pygame.Rect(50, 80, 500, 250)
+        self.regions.get("name").preview_area = pygame.Rect(600, 80, 500, 250)
+        # The optional regions get a smaller select button and preview each along the bottom of the window
+        for column, name in enumerate(("nhs_number", "dob", "appointment")):
+            region = self.regions.get(name)
+            region.button_rect = pygame.Rect(50 + column * 360, 345, 330, 30)
+            region.preview_area = pygame.Rect(50 + column * 360, 380, 330, 130)
 
         # Defining the debug buttons and toggle
         self.debug_toggle_rect = pygame.Rect(5, self.height - 35, 60, 30)
@@ -193,13 +2041,85 @@ class App:
         self.debug_more_rect = pygame.Rect(135, self.height - 35, 60, 30)
         self.debug_drop_table = pygame.Rect(200, self.height - 35, 60, 30)
         self.debug_print_db_rect = pygame.Rect(265, self.height - 35, 60, 30)
+        self.debug_threshold_rect = pygame.Rect(330, self.height - 35, 60, 30)  # Cycles the threshold mode
+        self.debug_scale_rect = pygame.Rect(395, self.height - 35, 60, 30)      # Cycles the target text height
+        self.debug_denoise_rect = pygame.Rect(460, self.height - 35, 60, 30)    # Cycles the denoise mode
 
         # A dictionary to track processed data per patient to avoid duplicate database operations
         self.last_processed = {}
 
-        # Instantiating the OCR processor objects for age and name
-        self.age_processor = AgeOCRProcessor()
-        self.name_processor = NameOCRProcessor()
+        # Shortcuts to the OCR processor objects for age and name
+        self.age_processor = self.regions.get("age").processor
+        self.name_processor = self.regions.get("name").processor
+
+        # Capture backend used for both region selection and OCR, and the shared frame grabber built on top of it so
+        # every region is cut from the same single capture each tick
+        self.capture_backend = capture_backend or open_capture_backend()
+        self.frame_grabber = FrameGrabber(self.capture_backend)
+
+        # Change detector that lets unchanged regions skip OCR. Each region keeps its last result so a region that did
+        # not change can still be paired with one that did
+        if change_detection == "exact":
+            self.change_detector = RegionChangeDetector()
+        else:
+            self.change_detector = PerceptualChangeDetector({region.name: region.processor for region in self.regions})
+
+        # Scheduler that polls quickly after a change and backs off while the screen is idle
+        self.scheduler = scheduler or AdaptiveScheduler()
+
+        # Optional SessionRecorder that every captured region is written to
+        self.recorder = None
+        self.database = database if database is not None else test  # Connection patients are recorded in
+        self.cursor = self.database.cursor()
+
+        # Optional OCRWorkerPool that reads the changed regions of a frame in parallel. Without one they are read in
+        # turn on the OCR thread
+        self.ocr_pool = ocr_pool
+        # With batch_ocr (and no pool) the changed regions are stitched into one image and read in a single tesseract
+        # call, which saves starting tesseract once per region when it runs as a separate program
+        self.batch_ocr = batch_ocr
+
+    # The age and name selections are kept in the region registry, these properties keep the old attribute names working
+    @property
+    def age_rect(self):
+        return self.regions.get("age").rect
+
+    @age_rect.setter
+    def age_rect(self, rect):
+        self.regions.get("age").rect = rect
+
+    @property
+    def name_rect(self):
+        return self.regions.get("name").rect
+
+    @name_rect.setter
+    def name_rect(self, rect):
+        self.regions.get("name").rect = rect
+
+    @property
+    def age_image(self):
+        return self.regions.get("age").image
+
+    @property
+    def name_image(self):
+        return self.regions.get("name").image
+
+    # Returns True once every required region has been selected and previewed
+    def required_regions_ready(self):
+        return all(region.image for region in self.regions.required())
+
+    # OCR counts as active while the stop event is clear. Setting this to False sets the event, which interrupts the
+    # worker's wait straight away instead of leaving it asleep until the next poll
+    @property
+    def ocr_active(self):
+        return not self.ocr_stop_event.is_set()
+
+    @ocr_active.setter
+    def ocr_active(self, active):
+        if active:
+            self.ocr_stop_event.clear()
+        else:
+            self.ocr_stop_event.set()
 
     # Main loop which handles events, updates the display, and manages the Tkinter window if it is currently open
     def run(self):
@@ -215,6 +2135,15 @@ class App:
                     self.output_window = None  # Handles any window closure errors
                     self.ocr_active = False
             self.clock.tick(30)  # Limits loop to 30 frames per second
+        self.stop_ocr()          # Lets the OCR worker finish cleanly before shutting down
+        if self.recorder:
+            self.recorder.close()  # Trims and closes the session recording
+        if BaseOCRProcessor.shared_ocr_backend:
+            BaseOCRProcessor.shared_ocr_backend.close()  # Frees the tesseract API handles
+        if self.ocr_pool:
+            self.ocr_pool.close()  # Stops the OCR worker processes
+        if BaseOCRProcessor.ocr_cache:
+            BaseOCRProcessor.ocr_cache.close()  # Saves the cache order for the next start-up
         pygame.quit()            # Cleans up pygame resources
         sys.exit()               # Exits the program
 
@@ -239,40 +2168,27 @@ class App:
                         print("Debug: Set OCR result to 70 (>65)")
                     # Drops and recreates tables in the database for testing or if you want to erase everything
                     if self.debug_drop_table.collidepoint(mouse_pos):
-                        cursor.execute('DROP TABLE IF EXISTS vaccination')
-                        cursor.execute('DROP TABLE IF EXISTS patient')
+                        self.cursor.execute('DROP TABLE IF EXISTS vaccination')
+                        self.cursor.execute('DROP TABLE IF EXISTS patient')
                         print("Debug: Dropped patient and vaccination tables.")
-                        cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS patient (
-                            ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                            age REAL,
-                            vaccine_type TEXT,
-                            patient_name TEXT,
-                            data_hash TEXT
-                        )
-                        ''')
-                        cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS vaccination (
-                            ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                            patient_id INTEGER,
-                            vaccine_type TEXT,
-                            date_administered TEXT,
-                            FOREIGN KEY (patient_id) REFERENCES patient(ID)
-                        )
-                        ''')
-                        test.commit()
+                        create_tables(self.cursor)
+                        self.database.commit()
                         print("Debug: Recreated tables.")
                     # Prints all database contents to the console for easy viewing
                     if self.debug_print_db_rect.collidepoint(mouse_pos):
                         self.print_database()
-                # Starts the age selection process if the corresponding button is clicked
-                if self.select_age_button_rect.collidepoint(mouse_pos):
-                    self.start_age_selection()
-                # Starts the name selection process if the corresponding button is clicked
-                if self.select_name_button_rect.collidepoint(mouse_pos):
-                    self.start_name_selection()
-                # Toggles the OCR processing if both age and name images are available
-                if self.ocr_button_rect.collidepoint(mouse_pos) and self.age_image and self.name_image:
+                    if self.debug_threshold_rect.collidepoint(mouse_pos):
+                        self.cycle_stage_setting("threshold", "mode", ("fixed", "otsu", "adaptive"))
+                    if self.debug_scale_rect.collidepoint(mouse_pos):
+                        self.cycle_stage_setting("scale", "target_text_height", (24, 32, 48))
+                    if self.debug_denoise_rect.collidepoint(mouse_pos):
+                        self.cycle_stage_setting("denoise", "mode", DenoiseStage.modes)
+                # Starts the selection process for whichever region's button was clicked
+                for region in self.regions:
+                    if region.button_rect.collidepoint(mouse_pos):
+                        self.start_region_selection(region.name)
+                # Toggles the OCR processing if the age and name images are available
+                if self.ocr_button_rect.collidepoint(mouse_pos) and self.required_regions_ready():
                     self.toggle_ocr()
                 # Spawns or closes the output window when its button is clicked
                 if self.spawn_output_button_rect.collidepoint(mouse_pos):
@@ -283,79 +2199,131 @@ class App:
                         self.spawn_output_window()      # Opens the window if it isn't already open
                         print("Output window spawned.")
 
-    # Initiates selection of the age region using the ScreenshotSelector
-    def start_age_selection(self):
+    # Initiates selection of the named region using the ScreenshotSelector
+    def start_region_selection(self, name):
+        region = self.regions.get(name)
         pygame.display.set_mode((1, 1))  # Switches to a minimal display for a full screen capture
         pygame.time.delay(100)           # A short delay to ensure the display update
-        selector = ScreenshotSelector()  # Creates a new instance of ScreenshotSelector
+        selector = ScreenshotSelector(self.capture_backend)  # Creates a new instance of ScreenshotSelector
         result = selector.select_area()  # Lets the user select a region
         if result is not None:
-            self.age_rect, selected_pil_image = result  # Stores the selected region and image
-            selected_pil_image = selected_pil_image.convert("RGB")
-            # Converts the image to RGB to ensure that pygame accepts it without error
-            mode = selected_pil_image.mode
-            size = selected_pil_image.size
-            data = selected_pil_image.tobytes()
-            self.age_image = pygame.image.fromstring(data, size, mode)  # Creates a pygame image from PIL data
+            region.rect, selected_pil_image = result  # Stores the selected region and image
+            region.image = image_to_surface(selected_pil_image)  # Creates a pygame image from the PIL data
         self.screen = pygame.display.set_mode((self.width, self.height))  # Restores the main display
         pygame.display.set_caption("Screenshot Selector")
         self.draw()                   # Redraws the interface
         pygame.display.flip()         # Updates the display
 
-    # Initiates selection of the patient name region using the ScreenshotSelector
-    def start_name_selection(self):
-        pygame.display.set_mode((1, 1))  # Switches to minimal display for a full screen capture
-        pygame.time.delay(100)           # Short delay for stability
-        selector = ScreenshotSelector()  # Creates a new ScreenshotSelector instance
-        result = selector.select_area()  # Lets the user select the region
-        if result is not None:
-            self.name_rect, selected_pil_image = result  # Store selected region and image
-            selected_pil_image = selected_pil_image.convert("RGB")
-            # Convert image to RGB to ensure that pygame accepts it without error
-            mode = selected_pil_image.mode
-            size = selected_pil_image.size
-            data = selected_pil_image.tobytes()
-            self.name_image = pygame.image.fromstring(data, size, mode)  # Creates pygame image from data
-        self.screen = pygame.display.set_mode((self.width, self.height))  # Restores main display
-        pygame.display.set_caption("Screenshot Selector")
-        self.draw()                   # Redraws the interface
-        pygame.display.flip()         # Updates display
-
     # Toggles the OCR process on or off
     def toggle_ocr(self):
         if not self.output_window:
             self.spawn_output_window()  # Ensures the output window exists for OCR results
         if self.ocr_active:
-            self.ocr_active = False     # Deactivates the image OCR if it's already active
+            self.stop_ocr()             # Deactivates the image OCR if it's already active
             print("OCR deactivated.")
-        else:
-            self.ocr_active = True      # Activates OCR
+        elif self.start_ocr():
             print("OCR activated.")
-            threading.Thread(target=self.ocr_loop, daemon=True).start()  # Starts OCR processing in a new thread
+
+    # Starts the OCR worker thread unless one is already running. Returns True if a worker is running afterwards
+    def start_ocr(self, timeout=2.0):
+        with self.ocr_thread_lock:
+            if self.ocr_thread and self.ocr_thread.is_alive():
+                if self.ocr_active:
+                    return True         # Already running, so a second loop is never started
+                # A stopped worker can still be finishing its last OCR call, so wait for it before starting a new one
+                self.ocr_thread.join(timeout)
+                if self.ocr_thread.is_alive():
+                    print("OCR worker is still finishing its last read, try again shortly.")
+                    return False
+            self.change_detector.reset()  # Makes sure the first tick reads every region again
+            self.scheduler.reset()        # Starts off polling at the fastest rate
+            self.ocr_active = True        # Activates OCR
+            self.ocr_thread = threading.Thread(target=self.ocr_loop, daemon=True)
+            self.ocr_thread.start()       # Starts OCR processing in a new thread
+            return True
+
+    # Signals the OCR worker to stop and waits up to timeout seconds for it to exit. Returns True if it has exited
+    def stop_ocr(self, timeout=2.0):
+        self.ocr_active = False           # Wakes the worker if it is waiting between polls
+        with self.ocr_thread_lock:
+            thread = self.ocr_thread
+        if thread is None or thread is threading.current_thread():
+            return True
+        thread.join(timeout)              # Only an OCR call already in progress can hold this up
+        return not thread.is_alive()
 
     # Continuous loop for OCR processing which runs in a separate thread
     def ocr_loop(self):
         while self.ocr_active:
-            if self.age_rect and self.name_rect:
-                # Captures and processes the age region
-                screenshot_age = pyautogui.screenshot(region=self.age_rect)
-                processed_age = self.age_processor.process_image(screenshot_age)
-                processed_age_rgb = processed_age.convert("RGB")  # Converts the processed image for display
-                self.age_image = pygame.image.fromstring(processed_age_rgb.tobytes(), processed_age_rgb.size, processed_age_rgb.mode)
-                age = self.age_processor.process_ocr(screenshot_age)  # Extracts any numeric age via OCR
-                # Captures and processes the name region
-                screenshot_name = pyautogui.screenshot(region=self.name_rect)
-                processed_name = self.name_processor.process_image(screenshot_name)
-                processed_name_rgb = processed_name.convert("RGB")  # Converts the processed image for display
-                self.name_image = pygame.image.fromstring(processed_name_rgb.tobytes(), processed_name_rgb.size, processed_name_rgb.mode)
-                name = self.name_processor.process_ocr(screenshot_name)  # Extracts patient name text via OCR
-                # Updates OCR results only if both age and name are valid
-                if age is not None and name:
-                    self.latest_ocr_number = age
-                    self.latest_patient_name = name
-                    print("OCR age result (number):", self.latest_ocr_number)
-                    print("OCR name result:", self.latest_patient_name)
-            time.sleep(5)  # Pauses for 5 seconds before next OCR cycle to not put too much of a load onto the users system
+            changed = self.ocr_tick()
+            # Waits a short time after a change and progressively longer while idle to not put too much of a load onto
+            # the users system. Waiting on the stop event means a stop request ends the wait immediately
+            self.ocr_stop_event.wait(self.scheduler.next_interval(changed))
+
+    # Runs one capture and OCR cycle over every selected region that is due, highest priority first. Regions whose
+    # pixels are identical to the previous read skip preprocessing and OCR, and if nothing changed at all the results
+    # and database are left alone. Returns True if any region changed
+    def ocr_tick(self):
+        if not all(region.rect for region in self.regions.required()):
+            return False
+        now = time.monotonic()
+        due = self.regions.due(now)
+        if not due:
+            return False
+        # Registers the current selections and takes one capture which every due region is sliced from
+        for region in due:
+            self.frame_grabber.register(region.name, region.rect)
+        crops = self.frame_grabber.grab([region.name for region in due])
+        if self.recorder:
+            timestamp = time.time()           # One timestamp for the whole tick marks where it starts on replay
+            for name, screenshot in crops.items():
+                self.recorder.record(name, screenshot, timestamp)
+        changed = []
+        for region in due:
+            region.last_read = now
+            screenshot = crops[region.name]
+            if not self.change_detector.has_changed(region.name, screenshot):
+                continue
+            # Preprocessed once: the preview surface shares its pixels with the image handed to tesseract
+            processed = region.processor.process_image(screenshot)
+            region.image = image_to_surface(processed)  # 8 bit grayscale preview of the binarised image
+            changed.append((region, screenshot, processed))
+        if not changed:
+            return False  # Same patient still on screen so there is nothing new to report or store
+        if self.ocr_pool or self.batch_ocr:
+            # Regions with a fast path (the age digits) are settled first and only the rest go to tesseract
+            pending = []
+            for region, _, processed in changed:
+                region.result = region.processor.fast_read(processed)
+                if region.result is None:
+                    pending.append((region, processed))
+            jobs = [(processed, region.processor.ocr_config) for region, processed in pending]
+            if self.ocr_pool:
+                # Every remaining region is read at once, one per worker process
+                results = self.ocr_pool.recognise_all(jobs, BaseOCRProcessor.ocr_cache)
+            else:
+                # Every remaining region is read at once from a composite of them all
+                results = BaseOCRProcessor.recognise_batch(jobs)
+            for (region, processed), (text, confidence) in zip(pending, results):
+                region.processor.learn(processed, text, confidence)
+                region.result = region.processor.parse_result(text)
+        else:
+            for region, screenshot, processed in changed:
+                if not self.ocr_active and threading.current_thread() is self.ocr_thread:
+                    break  # A stop request skips the lower priority regions still waiting for OCR
+                region.result = region.processor.process_ocr(screenshot, processed)  # Extracts the region's value via OCR
+        age = self.regions.get("age").result
+        name = self.regions.get("name").result
+        # Updates OCR results only if both age and name are valid
+        if age is not None and name:
+            self.latest_ocr_number = age
+            self.latest_patient_name = name
+            print("OCR age result (number):", self.latest_ocr_number)
+            print("OCR name result:", self.latest_patient_name)
+            for region in self.regions.selected():
+                if not region.required and region.result is not None:
+                    print(f"OCR {region.label} result:", region.result)
+        return True
 
     # Spawns a Tkinter window to actually display the OCR output
     def spawn_output_window(self):
@@ -382,7 +2350,7 @@ class App:
         if self.output_window:
             self.output_window.destroy()  # Destroys the Tkinter window
         self.output_window = None
-        self.ocr_active = False  # Deactivates OCR since the output window is closed
+        self.stop_ocr()  # Deactivates OCR since the output window is closed
         print("Output window closed. OCR deactivated.")
 
     # Updates the OCR output window with the latest OCR results or manual override settings
@@ -403,6 +2371,10 @@ class App:
                 bg_color = "#00FF00"  # Green for ages below 65
                 computed_vaccine = "Green"
             display_text = f"Age: {self.latest_ocr_number}  Name: {self.latest_patient_name}"
+            # Adds a line for each optional region that has been read
+            for region in self.regions:
+                if not region.required and region.rect and region.result is not None:
+                    display_text += f"\n{region.label}: {region.result}"
         else:
             bg_color = "#AAAAAA"  # Default background if there is no OCR result
             display_text = "Awaiting next input..."
@@ -411,53 +2383,57 @@ class App:
         self.output_label.configure(text=display_text, bg=bg_color)
         # If a valid OCR data is present, it updates the database accordingly
         if self.latest_patient_name and self.latest_ocr_number is not None and computed_vaccine:
-            current_hash = compute_record_hash(self.latest_ocr_number, self.latest_patient_name, computed_vaccine)
-            # Compute hash for integrity
-            current_data = (self.latest_ocr_number, computed_vaccine)
-            # Updates the database only if the current data is different from the last processed data to avoid duplicates
-            if self.last_processed.get(self.latest_patient_name) != current_data:
-                cursor.execute("SELECT age, data_hash FROM patient WHERE patient_name = ?", (self.latest_patient_name,))
-                row = cursor.fetchone()
-                if row:
-                    stored_age, stored_hash = row
-                    # Updates the record if the age or hash does not match the current data
-                    if stored_age != self.latest_ocr_number or stored_hash != current_hash:
-                        cursor.execute("UPDATE patient SET age = ?, vaccine_type = ?, data_hash = ? WHERE patient_name = ?",
-                                       (self.latest_ocr_number, computed_vaccine, current_hash, self.latest_patient_name))
-                        test.commit()
-                else:
-                    # Inserts a new record if the patient is not found in the database
-                    insert_query = '''
-                    INSERT INTO patient (age, vaccine_type, patient_name, data_hash)
-                    VALUES (?, ?, ?, ?)
-                    '''
-                    cursor.execute(insert_query, (self.latest_ocr_number, computed_vaccine, self.latest_patient_name, current_hash))
-                    test.commit()
-                self.record_vaccination(self.latest_patient_name, computed_vaccine)  # Record the vaccination event
-                self.last_processed[self.latest_patient_name] = current_data  # Update the last processed record
+            self.record_patient(self.latest_ocr_number, self.latest_patient_name, computed_vaccine)
+
+    # Inserts or updates the patient record for an OCR result and records today's vaccination for them
+    def record_patient(self, age, patient_name, vaccine_type):
+        current_hash = compute_record_hash(age, patient_name, vaccine_type)
+        # Compute hash for integrity
+        current_data = (age, vaccine_type)
+        # Updates the database only if the current data is different from the last processed data to avoid duplicates
+        if self.last_processed.get(patient_name) != current_data:
+            self.cursor.execute("SELECT age, data_hash FROM patient WHERE patient_name = ?", (patient_name,))
+            row = self.cursor.fetchone()
+            if row:
+                stored_age, stored_hash = row
+                # Updates the record if the age or hash does not match the current data
+                if stored_age != age or stored_hash != current_hash:
+                    self.cursor.execute("UPDATE patient SET age = ?, vaccine_type = ?, data_hash = ? WHERE patient_name = ?",
+                                   (age, vaccine_type, current_hash, patient_name))
+                    self.database.commit()
+            else:
+                # Inserts a new record if the patient is not found in the database
+                insert_query = '''
+                INSERT INTO patient (age, vaccine_type, patient_name, data_hash)
+                VALUES (?, ?, ?, ?)
+                '''
+                self.cursor.execute(insert_query, (age, vaccine_type, patient_name, current_hash))
+                self.database.commit()
+            self.record_vaccination(patient_name, vaccine_type)  # Record the vaccination event
+            self.last_processed[patient_name] = current_data  # Update the last processed record
 
     # Records a vaccination event in the database for the specified patient and vaccine type, if it's not already recorded for today
     def record_vaccination(self, patient_name, vaccine_type):
-        cursor.execute("SELECT ID FROM patient WHERE patient_name = ?", (patient_name,))
-        row = cursor.fetchone()
+        self.cursor.execute("SELECT ID FROM patient WHERE patient_name = ?", (patient_name,))
+        row = self.cursor.fetchone()
         if row:
             patient_id = row[0]
             date_administered = datetime.now().strftime("%Y-%m-%d")  # Get current date in YYYY-MM-DD format
             # Checks if a vaccination record exists for this patient, vaccine, and date
-            cursor.execute('''
+            self.cursor.execute('''
                 SELECT COUNT(*) FROM vaccination
                 WHERE patient_id = ?
                   AND vaccine_type = ?
                   AND date_administered = ?
             ''', (patient_id, vaccine_type, date_administered))
-            count = cursor.fetchone()[0]
+            count = self.cursor.fetchone()[0]
             if count == 0:
                 # Inserts a new vaccination record if none exists for today
-                cursor.execute('''
+                self.cursor.execute('''
                     INSERT INTO vaccination (patient_id, vaccine_type, date_administered)
                     VALUES (?, ?, ?)
                 ''', (patient_id, vaccine_type, date_administered))
-                test.commit()
+                self.database.commit()
 
     # Manual override function to clear any manual settings and reset the output window
     def manual_clear(self):
@@ -488,13 +2464,13 @@ class App:
 
     # Prints the contents of the joined patient and vaccination tables to the console for debugging and/or viewing
     def print_database(self):
-        cursor.execute('''
+        self.cursor.execute('''
             SELECT p.ID, p.age, p.vaccine_type, p.patient_name,
                    v.vaccine_type, v.date_administered
             FROM patient p
             LEFT JOIN vaccination v ON p.ID = v.patient_id
         ''')
-        rows = cursor.fetchall()
+        rows = self.cursor.fetchall()
         print("Joined Patient/Vaccination Data:")
         print("PatientID | Age | PatientTable_VaccineType | PatientName | VaccinationTable_VaccineType | DateAdministered")
         for row in rows:
@@ -512,34 +2488,26 @@ class App:
     # Redraws the entire pygame window, including buttons and preview areas
     def draw(self):
         self.screen.fill((30, 30, 30))  # Fills the background with a dark gray color for a clean look
-        self.draw_button(self.select_age_button_rect, "Select Age Area", (70, 70, 200), (100, 100, 230))
-        self.draw_button(self.select_name_button_rect, "Select Name Area", (70, 70, 200), (100, 100, 230))
+        for region in self.regions:
+            self.draw_button(region.button_rect, f"Select {region.label} Area", (70, 70, 200), (100, 100, 230))
         if self.ocr_active:
             self.draw_button(self.ocr_button_rect, "Stop Image OCR", (200, 70, 70), (230, 100, 100))
         else:
-            disabled = (self.age_image is None or self.name_image is None)
+            disabled = not self.required_regions_ready()
             self.draw_button(self.ocr_button_rect, "Begin Screen Reading",
                              (70, 200, 70), (100, 230, 100), disabled=disabled)
         spawn_text = "Kill Output Window" if self.output_window else "Spawn Output Window"
         self.draw_button(self.spawn_output_button_rect, spawn_text, (70, 130, 200), (100, 150, 230))
-        # Draws the preview area for the age image
-        pygame.draw.rect(self.screen, (50, 50, 50), self.age_preview_area)
-        if self.age_image:
-            preview_age = letterbox_image(self.age_image, self.age_preview_area.width, self.age_preview_area.height)
-            self.screen.blit(preview_age, self.age_preview_area.topleft)
-        else:
-            placeholder = self.font.render("Age area not selected.", True, (255, 255, 255))
-            ph_rect = placeholder.get_rect(center=self.age_preview_area.center)
-            self.screen.blit(placeholder, ph_rect)
-        # Draws the preview area for the name image
-        pygame.draw.rect(self.screen, (50, 50, 50), self.name_preview_area)
-        if self.name_image:
-            preview_name = letterbox_image(self.name_image, self.name_preview_area.width, self.name_preview_area.height)
-            self.screen.blit(preview_name, self.name_preview_area.topleft)
-        else:
-            placeholder = self.font.render("Name area not selected.", True, (255, 255, 255))
-            ph_rect = placeholder.get_rect(center=self.name_preview_area.center)
-            self.screen.blit(placeholder, ph_rect)
+        # Draws the preview area for each region
+        for region in self.regions:
+            pygame.draw.rect(self.screen, (50, 50, 50), region.preview_area)
+            if region.image:
+                preview = letterbox_image(region.image, region.preview_area.width, region.preview_area.height)
+                self.screen.blit(preview, region.preview_area.topleft)
+            else:
+                placeholder = self.font.render(f"{region.label} area not selected.", True, (255, 255, 255))
+                ph_rect = placeholder.get_rect(center=region.preview_area.center)
+                self.screen.blit(placeholder, ph_rect)
         # Draws the debug buttons if debug mode is enabled
         self.draw_button(self.debug_toggle_rect, "Debug", (80, 80, 80), (110, 110, 110))
         if self.debug_mode:
@@ -547,10 +2515,249 @@ class App:
             self.draw_button(self.debug_more_rect, ">65", (80, 80, 80), (110, 110, 110))
             self.draw_button(self.debug_drop_table, "Drop", (80, 80, 80), (110, 110, 110))
             self.draw_button(self.debug_print_db_rect, "PrintDB", (80, 80, 80), (110, 110, 110))
+            self.draw_button(self.debug_threshold_rect, "Thresh", (80, 80, 80), (110, 110, 110))
+            self.draw_button(self.debug_scale_rect, "Scale", (80, 80, 80), (110, 110, 110))
+            self.draw_button(self.debug_denoise_rect, "Denoise", (80, 80, 80), (110, 110, 110))
+            # Shows how many ticks each region skipped OCR because its pixels had not changed
+            stats_text = self.change_detector.summary()
+            if self.ocr_pool:
+                stats_text += "   OCR pool " + self.ocr_pool.summary()
+            if BaseOCRProcessor.ocr_cache:
+                stats_text += "   " + BaseOCRProcessor.ocr_cache.summary()
+            stats_surface = self.font.render(stats_text, True, (200, 200, 200))
+            self.screen.blit(stats_surface, (self.debug_denoise_rect.right + 10, self.height - 28))
+            # How much of each region was left after cropping to the text
+            crop_surface = self.font.render(self.crop_summary(), True, (200, 200, 200))
+            self.screen.blit(crop_surface, (self.debug_denoise_rect.right + 10, self.height - 50))
+            # And the current preprocessing settings with the average time of each stage over every region
+            timing_surface = self.font.render(self.pipeline_summary(), True, (200, 200, 200))
+            self.screen.blit(timing_surface, (self.debug_toggle_rect.left, self.height - 72))
         pygame.display.flip()  # Update the display
 
+    # Returns a short "name: kept% at scale" summary of how many pixels each region still had after cropping to its
+    # text, and the upscale factor its text height called for
+    def crop_summary(self):
+        parts = []
+        for region in self.regions:
+            crop = region.processor.preprocessor.stage("crop")
+            if crop.pixels_original:
+                scale = region.processor.preprocessor.stage("scale")
+                parts.append(f"{region.name}: {crop.crop_ratio():.0f}% of pixels OCRed at {scale.last_factor}x")
+        return "  ".join(parts)
+
+    # Returns the threshold mode and target text height in use, then each preprocessing stage's average time across
+    # every region that has run
+    def pipeline_summary(self):
+        pipelines = [region.processor.preprocessor for region in self.regions]
+        parts = [f"threshold: {pipelines[0].stage('threshold').mode}",
+                 f"text height: {pipelines[0].stage('scale').target_text_height}px",
+                 f"denoise: {pipelines[0].stage('denoise').mode} "
+                 f"({sum(pipeline.stage('denoise').pixels_changed for pipeline in pipelines)} px changed)"]
+        for index, stage in enumerate(pipelines[0].stages):
+            calls = sum(pipeline.stages[index].calls for pipeline in pipelines)
+            seconds = sum(pipeline.stages[index].seconds for pipeline in pipelines)
+            hits = sum(pipeline.stages[index].memo_hits for pipeline in pipelines)
+            parts.append(f"{stage.name}: {seconds * 1000 / calls if calls else 0:.2f}ms ({hits} memo)")
+        return "  ".join(parts)
+
+    # Moves a preprocessing setting on to the next of its choices for every region, then forgets the change detector's
+    # fingerprints so each region is run again. The pipeline memo means only the changed stage and those after it redo
+    # any work
+    def cycle_stage_setting(self, stage_name, attribute, choices):
+        current = getattr(self.regions.get("age").processor.preprocessor.stage(stage_name), attribute)
+        value = choices[(choices.index(current) + 1) % len(choices)] if current in choices else choices[0]
+        for region in self.regions:
+            setattr(region.processor.preprocessor.stage(stage_name), attribute, value)
+        self.change_detector.reset()
+
+# Parses an "x,y,width,height" command line argument into a region tuple
+def parse_rect(text):
+    return tuple(int(value) for value in text.split(","))
+
+# Runs the capture -> OCR -> database pipeline back to back with no delay and reports the average time per tick.
+# Used with a replay source so it can run on a machine without a display, e.g. --source darkmode --benchmark 50.
+# The app should be given a scratch database (main passes an in-memory one) so the results are not stored as patients
+def benchmark_pipeline(app, ticks):
+    app.ocr_active = True
+    start_time = time.perf_counter()
+    for _ in range(ticks):
+        app.ocr_tick()
+        if app.latest_ocr_number is not None and app.latest_patient_name:
+            vaccine_type = "Blue" if app.latest_ocr_number >= 65 else "Green"
+            app.record_patient(app.latest_ocr_number, app.latest_patient_name, vaccine_type)
+    elapsed = time.perf_counter() - start_time
+    app.ocr_active = False
+    print(f"{ticks} ticks in {elapsed:.3f}s ({elapsed / ticks * 1000:.1f} ms per tick)")
+    print("Change detection:", app.change_detector.summary())
+    print("Cropping:", app.crop_summary())
+    print("Preprocessing:", app.pipeline_summary())
+    if app.ocr_pool:
+        print("OCR pool:", app.ocr_pool.summary())
+    if BaseOCRProcessor.ocr_cache:
+        print(BaseOCRProcessor.ocr_cache.summary())
+
+# Times the hand-off of a full 4K frame from PIL to pygame using the old convert/tobytes/fromstring chain and the
+# shared buffer path, for both a captured colour frame and a binarised OCR image
+def benchmark_image_handoff(repeats=20):
+    width, height = 3840, 2160
+    frame = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    binarised = frame.convert("L").point(lambda x: 0 if x < 128 else 255, '1')
+    bgrx = FrameBuffer(os.urandom(width * height * 4), (width, height), "BGRX")  # What XShmCaptureBackend returns
+
+    def old_path(image):
+        rgb = image.convert("RGB")
+        return pygame.image.fromstring(rgb.tobytes(), rgb.size, rgb.mode)
+
+    cases = [("colour frame, convert/tobytes/fromstring", lambda: old_path(frame)),
+             ("colour frame, shared buffer", lambda: image_to_surface(frame)),
+             ("binarised frame, convert/tobytes/fromstring", lambda: old_path(binarised)),
+             ("binarised frame, shared buffer", lambda: image_to_surface(binarised)),
+             ("raw BGRX capture, shared buffer", lambda: bgrx.to_surface())]
+    for label, handoff in cases:
+        timings = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            handoff()
+            timings.append(time.perf_counter() - start_time)
+        print(f"{label:<45} {sorted(timings)[repeats // 2] * 1000:8.2f} ms (median of {repeats})")
+
+# Times the PIL reference preprocessing against the NumPy engine on the two sample regions
+def benchmark_preprocessing(repeats=200):
+    processor = AgeOCRProcessor()
+    for path in ("../test_age.png", "../test_name.png"):
+        with Image.open(path) as img:
+            screenshot = img.convert("RGB")
+        for engine in ("pil", "numpy"):
+            processor.engine = engine
+            timings = []
+            for _ in range(repeats):
+                processor.preprocessor.clear_memo()  # Otherwise every repeat after the first is a memo hit
+                start_time = time.perf_counter()
+                processor.process_image(screenshot)
+                timings.append(time.perf_counter() - start_time)
+            print(f"{os.path.basename(path):<14} {engine:<6} {sorted(timings)[repeats // 2] * 1000:7.3f} ms "
+                  f"(median of {repeats})")
+        pipeline = processor.preprocessor
+        left, top, right, bottom = pipeline.stage("crop").last_box
+        print(f"{os.path.basename(path):<14} cropped to {(right - left) * (bottom - top)} of "
+              f"{screenshot.width * screenshot.height} pixels, upscaled {pipeline.stage('scale').last_factor}x")
+        print(f"{os.path.basename(path):<14} stages: {pipeline.timing_summary()}")
+
+# Times reading test_age.png with tesseract and with the digit template matcher, which learns the glyphs from the
+# first tesseract read. The tesseract reads go straight to the backend so the OCR cache cannot answer them
+def benchmark_digits(repeats=1000, tesseract_repeats=20):
+    processor = AgeOCRProcessor()
+    with Image.open("../test_age.png") as img:
+        processed = processor.process_image(img.convert("RGB"))
+    backend = processor.shared_backend()
+    text, confidence = backend.recognise(processed, processor.ocr_config)  # Also loads the language data
+    processor.learn(processed, text, confidence)
+    timings = []
+    for _ in range(tesseract_repeats):
+        start_time = time.perf_counter()
+        backend.recognise(processed, processor.ocr_config)
+        timings.append(time.perf_counter() - start_time)
+    print(f"tesseract  {sorted(timings)[tesseract_repeats // 2] * 1000:8.3f} ms  read {processor.parse_result(text)!r} "
+          f"(confidence {confidence}, median of {tesseract_repeats})")
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        value = processor.fast_read(processed)
+        timings.append(time.perf_counter() - start_time)
+    matcher = processor.digit_matcher
+    print(f"templates  {sorted(timings)[repeats // 2] * 1000:8.3f} ms  read {value!r} "
+          f"(worst glyph correlation {matcher.last_score}, {len(matcher.labels)} templates, median of {repeats})")
+
 # This creates an instance of App and runs the main loop which essentially starts the whole program
 if __name__ == '__main__':
-    app = App()
-    app.run()
+    parser = argparse.ArgumentParser(description="Reads patient details off the screen and colour codes their vaccine")
+    parser.add_argument("--source", help="'screen' (pyautogui) or 'xshm' (Linux X11) for the live screen, or a folder "
+                                         "of images, single image or --record session file to read instead")
+    parser.add_argument("--benchmark", type=int, metavar="TICKS",
+                        help="Run this many pipeline ticks without the GUI and report the timing")
+    parser.add_argument("--benchmark-handoff", action="store_true",
+                        help="Time moving a 4K frame from PIL to pygame with and without the shared buffer path")
+    parser.add_argument("--benchmark-preprocessing", action="store_true",
+                        help="Time the PIL and NumPy preprocessing engines on test_age.png and test_name.png")
+    parser.add_argument("--benchmark-digits", action="store_true",
+                        help="Time reading test_age.png with tesseract and with the digit template matcher")
+    parser.add_argument("--threshold-mode", choices=("otsu", "adaptive", "fixed"), default="otsu",
+                        help="How the black/white threshold is chosen for each region")
+    parser.add_argument("--ocr-backend", choices=("auto", "api", "pytesseract"), default="auto",
+                        help="'api' keeps libtesseract loaded in process, 'pytesseract' runs tesseract.exe per read, "
+                             "'auto' uses the API when libtesseract can be loaded")
+    parser.add_argument("--ocr-workers", type=int, default=0, metavar="N",
+                        help="Read the regions of each frame in parallel on N OCR worker processes (0 = on the OCR thread)")
+    parser.add_argument("--batch-ocr", action="store_true",
+                        help="Read all the changed regions of a frame in one tesseract call on a stitched image")
+    parser.add_argument("--ocr-cache-size", type=int, default=256, metavar="N",
+                        help="Remember the OCR results of the last N distinct region images (0 turns the cache off)")
+    parser.add_argument("--ocr-cache-file", metavar="PATH",
+                        help="sqlite file the OCR cache is kept in across restarts")
+    parser.add_argument("--denoise", choices=DenoiseStage.modes, default="off",
+                        help="Speckle filter applied to each region after thresholding")
+    parser.add_argument("--record", metavar="PATH", help="Record every captured region to this session file")
+    parser.add_argument("--replay-session", metavar="PATH",
+                        help="Run a recorded session file back through the OCR processors and exit")
+    parser.add_argument("--change-detection", choices=("perceptual", "exact"), default="perceptual",
+                        help="How a region is judged to have changed since the last tick")
+    parser.add_argument("--min-interval", type=float, default=0.1,
+                        help="Seconds between screen polls straight after a change")
+    parser.add_argument("--max-interval", type=float, default=0.5,
+                        help="Longest wait between screen polls while nothing is changing")
+    parser.add_argument("--age-rect", type=parse_rect, help="Age region as x,y,width,height (benchmark only)")
+    parser.add_argument("--name-rect", type=parse_rect, help="Name region as x,y,width,height (benchmark only)")
+    args = parser.parse_args()
+    if args.ocr_backend != "auto":
+        BaseOCRProcessor.shared_ocr_backend = open_ocr_backend(args.ocr_backend)
+    if args.ocr_cache_size > 0:
+        BaseOCRProcessor.ocr_cache = OCRResultCache(args.ocr_cache_size, args.ocr_cache_file)
+    if args.benchmark_handoff:
+        benchmark_image_handoff()
+        sys.exit()
+    if args.benchmark_preprocessing:
+        benchmark_preprocessing()
+        sys.exit()
+    if args.benchmark_digits:
+        benchmark_digits()
+        sys.exit()
+    if args.replay_session:
+        processors = {region.name: region.processor for region in build_region_registry()}
+        for processor in processors.values():
+            processor.preprocessor.stage("threshold").mode = args.threshold_mode
+            processor.preprocessor.stage("denoise").mode = args.denoise
+        replay_session(args.replay_session, processors)
+        sys.exit()
+    if args.benchmark:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"  # Benchmarks never show a window so a display is not needed
+        pygame.display.quit()
+        pygame.display.init()
+    ocr_pool = None
+    if args.ocr_workers:
+        configs = {region.processor.ocr_config for region in build_region_registry()}
+        ocr_pool = OCRWorkerPool(args.ocr_workers, None if args.ocr_backend == "auto" else args.ocr_backend, configs)
+    app = App(open_capture_backend(args.source), args.change_detection,
+              AdaptiveScheduler(args.min_interval, args.max_interval), ocr_pool, args.batch_ocr,
+              open_database(":memory:") if args.benchmark else None)
+    if args.record:
+        app.recorder = SessionRecorder(args.record)
+    for region in app.regions:
+        region.processor.preprocessor.stage("threshold").mode = args.threshold_mode
+        region.processor.preprocessor.stage("denoise").mode = args.denoise
+    if args.benchmark:
+        full_frame = (0, 0) + tuple(app.capture_backend.size())  # Regions default to the whole replayed frame
+        recorded = getattr(app.capture_backend, "region_rects", {})  # Where a replayed session put each region
+        for region in app.regions:
+            region.rect = recorded.get(region.name)
+        app.age_rect = args.age_rect or recorded.get("age") or full_frame
+        app.name_rect = args.name_rect or recorded.get("name") or full_frame
+        benchmark_pipeline(app, args.benchmark)
+        if app.recorder:
+            app.recorder.close()
+        if app.ocr_pool:
+            app.ocr_pool.close()
+        if BaseOCRProcessor.ocr_cache:
+            BaseOCRProcessor.ocr_cache.close()
+    else:
+        app.run()
 
@@ -1,10 +1,102 @@
+import argparse
+import json
 import os
 import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 from PIL import Image, ImageOps, ImageFilter
 
+try:
+    import resource
+except ImportError:  # Not available on Windows, where the benchmark falls back to tracemalloc
+    resource = None
+
+
+# Fixed-point versions of the 0.299/0.587/0.114 luminance weights, scaled by 256 so they sum to 256
+LUMINANCE_WEIGHTS = (77, 150, 29)
+# Rows of the image handled per pass, sized so the uint16 luminance scratch stays around 1 MiB whatever the capture size
+SCRATCH_BYTES = 1 << 20
+
+
+def image_to_array(img):
+    """
+    Copy an RGB PIL image into a new writable (height, width, 3) uint8 array, a band of rows at a time.
+
+    np.array(img) goes through img.tobytes(), so for a moment it holds two full-size copies of the pixels. Filling
+    the array from small crops keeps the peak to the array itself plus one band.
+    """
+    width, height = img.size
+    img_array = np.empty((height, width, 3), np.uint8)
+    band_rows = max(1, SCRATCH_BYTES // (3 * width))
+    for top in range(0, height, band_rows):
+        bottom = min(top + band_rows, height)
+        img_array[top:bottom] = np.asarray(img.crop((0, top, width, bottom)))
+    return img_array
+
+
+def invert_and_whiten(img_array, threshold=220):
+    """
+    Invert an RGB uint8 array in place and force every pixel whose (inverted) luminance reaches the threshold to white.
+
+    This is the memory-lean version of the float path in invert_and_whiten_reference. Luminance is computed with
+    integer weights out of 256 into a small uint16 scratch buffer, a band of rows at a time, so no full-size float
+    arrays or inverted copies are ever allocated. The only full-size buffer is the image array itself.
+
+    Args:
+        img_array (numpy.ndarray): Writable (height, width, 3) uint8 array, modified in place.
+        threshold (int): Luminance threshold [0..255] for forcing pixels to white.
+
+    Returns:
+        numpy.ndarray: The same array, for convenience.
+    """
+    np.invert(img_array, out=img_array)  # 255 - x for uint8, without a copy
+    height, width = img_array.shape[:2]
+    band_rows = max(1, SCRATCH_BYTES // (2 * width))
+    scratch = np.empty((band_rows, width), np.uint16)
+    term = np.empty((band_rows, width), np.uint16)
+    mask = np.empty((band_rows, width), np.bool_)
+    red_weight, green_weight, blue_weight = LUMINANCE_WEIGHTS
+    level = threshold << 8
+    for top in range(0, height, band_rows):
+        band = img_array[top:top + band_rows]
+        rows = band.shape[0]
+        luminance, weighted, bright = scratch[:rows], term[:rows], mask[:rows]
+        np.multiply(band[..., 0], red_weight, out=luminance, dtype=np.uint16)
+        np.multiply(band[..., 1], green_weight, out=weighted, dtype=np.uint16)
+        luminance += weighted
+        np.multiply(band[..., 2], blue_weight, out=weighted, dtype=np.uint16)
+        luminance += weighted
+        np.greater_equal(luminance, level, out=bright)
+        band[bright] = 255
+    return img_array
+
+
+def invert_and_whiten_reference(img, threshold=220):
+    """
+    The original float implementation, kept as the reference invert_and_whiten is checked and benchmarked against.
+    Takes an RGB PIL image and returns a new uint8 array.
+    """
+    # Invert colors
+    inverted_img = ImageOps.invert(img)
+
+    # Convert to NumPy array for thresholding
+    img_array = np.array(inverted_img, dtype=np.uint8)
+
+    # Calculate luminance for each pixel (0.299*R + 0.587*G + 0.114*B)
+    luminance = 0.299 * img_array[..., 0] + 0.587 * img_array[..., 1] + 0.114 * img_array[..., 2]
+
+    # Create a mask for pixels that are bright enough to be considered background
+    mask = luminance >= threshold
 
-def convert_image(image_path, output_path, threshold=220, upscale_factor=2, apply_sharpen=True):
+    # Force those pixels to pure white
+    img_array[mask] = [255, 255, 255]
+    return img_array
+
+
+def convert_image(image_path, output_path, threshold=220, upscale_factor=2, apply_sharpen=True, quiet=False):
     """
     Convert a dark-mode screenshot to a light-mode look, with some noise reduction:
       1. Invert colors.
@@ -18,6 +110,7 @@ def convert_image(image_path, output_path, threshold=220, upscale_factor=2, appl
         threshold (int): Luminance threshold [0..255] for forcing pixels to white.
         upscale_factor (int): Factor by which to upscale the image (1 = no upscale).
         apply_sharpen (bool): Whether to apply a sharpen filter after upscaling.
+        quiet (bool): Raise errors to the caller instead of printing progress and failures (used by the workers).
     """
     try:
         with Image.open(image_path) as img:
@@ -25,23 +118,15 @@ def convert_image(image_path, output_path, threshold=220, upscale_factor=2, appl
             if img.mode != 'RGB':
                 img = img.convert('RGB')
 
-            # 2) Invert colors
-            inverted_img = ImageOps.invert(img)
-
-            # 3) Convert to NumPy array for thresholding
-            img_array = np.array(inverted_img, dtype=np.uint8)
-
-            # Calculate luminance for each pixel (0.299*R + 0.587*G + 0.114*B)
-            luminance = 0.299 * img_array[..., 0] + 0.587 * img_array[..., 1] + 0.114 * img_array[..., 2]
-
-            # Create a mask for pixels that are bright enough to be considered background
-            mask = luminance >= threshold
+            # 2) Copy the pixels into one writable uint8 buffer
+            img_array = image_to_array(img)
 
-            # Force those pixels to pure white
-            img_array[mask] = [255, 255, 255]
+            # 3) Invert colors and force background pixels to pure white, in place
+            invert_and_whiten(img_array, threshold)
 
-            # 4) Convert back to PIL image
-            processed_img = Image.fromarray(img_array)
+            # 4) Hand the pixels back to PIL. This is one copy, as PIL cannot share a buffer of 3 byte RGB pixels
+            height, width = img_array.shape[:2]
+            processed_img = Image.frombuffer('RGB', (width, height), img_array, 'raw', 'RGB', 0, 1)
 
             # 5) Optional: Upscale for clarity
             if upscale_factor > 1:
@@ -55,74 +140,246 @@ def convert_image(image_path, output_path, threshold=220, upscale_factor=2, appl
 
             # Save the result
             processed_img.save(output_path)
-            print(f"Converted: {image_path} -> {output_path}")
+            if not quiet:
+                print(f"Converted: {image_path} -> {output_path}")
     except Exception as e:
+        if quiet:
+            raise
         print(f"Failed to process {image_path}: {e}")
 
 
-def process_folder(input_folder, output_folder, threshold, upscale_factor, apply_sharpen):
+MANIFEST_NAME = ".conversion_manifest.json"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+def find_images(input_folder, recursive=False):
     """
-    Process all images in a given folder with the above conversion function.
+    List the image files in a folder as paths relative to it, sorted so runs are repeatable.
     """
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    if not recursive:
+        names = [name for name in os.listdir(input_folder)
+                 if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(input_folder, name))]
+        return sorted(names)
+    found = []
+    for directory, _, file_names in os.walk(input_folder):
+        for file_name in file_names:
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(directory, file_name), input_folder))
+    return sorted(found)
 
-    # Common image file extensions
-    extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
 
-    found_any = False
-    for file_name in os.listdir(input_folder):
-        if file_name.lower().endswith(extensions):
-            found_any = True
-            input_path = os.path.join(input_folder, file_name)
-            output_path = os.path.join(output_folder, file_name)
-            convert_image(input_path, output_path, threshold, upscale_factor, apply_sharpen)
+def load_manifest(output_folder):
+    """
+    Load the manifest of already converted images from the output folder, or an empty one if there is none yet.
 
-    if not found_any:
+    The manifest maps each input path (relative to the input folder) to the mtime and size the file had and the
+    parameters it was converted with.
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_folder, manifest):
+    """
+    Write the manifest atomically, so an interrupted run never leaves a half written file behind.
+    """
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    temporary_path = manifest_path + ".tmp"
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+
+def convert_job(job):
+    """
+    Worker entry point for the process pool. Converts one image and returns (relative path, error message or None).
+    """
+    relative_path, input_path, output_path, threshold, upscale_factor, apply_sharpen = job
+    output_directory = os.path.dirname(output_path)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    try:
+        convert_image(input_path, output_path, threshold, upscale_factor, apply_sharpen, quiet=True)
+    except Exception as e:
+        return relative_path, str(e)
+    return relative_path, None
+
+
+def process_folder(input_folder, output_folder, threshold, upscale_factor, apply_sharpen,
+                   workers=None, recursive=False, force=False):
+    """
+    Convert every image in a folder, spreading the work over a pool of processes.
+
+    Images whose mtime, size and conversion parameters match the manifest from a previous run, and whose output
+    still exists, are skipped. Results are printed as each image finishes rather than in folder order, and the
+    manifest is saved every 100 images so an interrupted run loses little work.
+
+    Args:
+        workers (int): Number of worker processes (None = one per CPU).
+        recursive (bool): Also convert images in subfolders, mirroring the folder structure in the output.
+        force (bool): Convert every image even if the manifest says it is up to date.
+
+    Returns:
+        tuple: Counts of (converted, skipped, failed) images.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    images = find_images(input_folder, recursive)
+    if not images:
         print("No valid image files found in the folder.")
+        return 0, 0, 0
+
+    params = {"threshold": threshold, "upscale_factor": upscale_factor, "apply_sharpen": apply_sharpen}
+    manifest = {} if force else load_manifest(output_folder)
+    jobs = []
+    stats = {}
+    skipped = 0
+    for relative_path in images:
+        input_path = os.path.join(input_folder, relative_path)
+        output_path = os.path.join(output_folder, relative_path)
+        file_stat = os.stat(input_path)
+        stats[relative_path] = {"mtime": file_stat.st_mtime, "size": file_stat.st_size, "params": params}
+        if manifest.get(relative_path) == stats[relative_path] and os.path.exists(output_path):
+            skipped += 1
+            continue
+        jobs.append((relative_path, input_path, output_path, threshold, upscale_factor, apply_sharpen))
+    print(f"{len(images)} images found, {skipped} unchanged since the last run, {len(jobs)} to convert.")
 
+    converted = failed = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(convert_job, job) for job in jobs]
+            for done, future in enumerate(as_completed(futures), 1):
+                relative_path, error = future.result()
+                if error is None:
+                    converted += 1
+                    manifest[relative_path] = stats[relative_path]
+                    print(f"[{done}/{len(jobs)}] Converted: {relative_path}")
+                else:
+                    failed += 1
+                    manifest.pop(relative_path, None)
+                    print(f"[{done}/{len(jobs)}] Failed to process {relative_path}: {error}")
+                if done % 100 == 0:
+                    save_manifest(output_folder, manifest)
+    save_manifest(output_folder, manifest)
+    return converted, skipped, failed
 
-def main():
-    print("=== Dark Mode to Light Mode Converter (Enhanced) ===")
 
-    # Prompt for input folder
-    input_folder = input("Enter the path to the folder containing dark mode screenshots: ").strip()
-    if not os.path.isdir(input_folder):
+# The two masking implementations compared by the benchmark, by the label it prints
+MASKING_VARIANTS = {
+    "float reference": lambda img: invert_and_whiten_reference(img),
+    "fixed point in place": lambda img: invert_and_whiten(image_to_array(img)),
+}
+
+
+def synthetic_capture(width, height):
+    """
+    Return the same random RGB image every time, standing in for a screen capture of the given size.
+
+    The image is filled a band of rows at a time, so making it leaves no freed full-size buffer behind to hide the
+    memory a masking variant allocates from the peak RSS.
+    """
+    rng = np.random.default_rng(0)
+    img = Image.new("RGB", (width, height))
+    band_rows = max(1, SCRATCH_BYTES // (3 * width))
+    for top in range(0, height, band_rows):
+        rows = min(band_rows, height - top)
+        img.paste(Image.fromarray(rng.integers(0, 256, (rows, width, 3), dtype=np.uint8)), (0, top))
+    return img
+
+
+def masking_peak_rss(label, width, height):
+    """
+    Run one masking variant once and return how far it raised the peak resident set size of the process, in bytes.
+    Meant to be run in a fresh worker process so the other variant's memory does not hide it.
+    """
+    img = synthetic_capture(width, height)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    MASKING_VARIANTS[label](img)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (after - before) * (1 if sys.platform == "darwin" else 1024)  # ru_maxrss is in KiB apart from on macOS
+
+
+def benchmark_masking(width=7680, height=2160, repeats=5):
+    """
+    Time the float reference against invert_and_whiten on a synthetic multi-monitor capture (two 4K screens side by
+    side by default) and report how much each one raises the peak RSS, measured in a fresh process per variant. RSS
+    includes Pillow's buffers and the temporaries NumPy frees straight away. Where the resource module is missing
+    (Windows) the peak of NumPy's allocations from tracemalloc is reported instead.
+    """
+    peaks = {}
+    for label in MASKING_VARIANTS:
+        if resource is not None:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                peaks[label] = executor.submit(masking_peak_rss, label, width, height).result()
+        else:
+            img = synthetic_capture(width, height)
+            tracemalloc.start()
+            MASKING_VARIANTS[label](img)
+            peaks[label] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    peak_name = "peak RSS" if resource is not None else "NumPy allocation peak"
+    img = synthetic_capture(width, height)
+    results = {}
+    for label, run in MASKING_VARIANTS.items():
+        timings = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            results[label] = run(img)
+            timings.append(time.perf_counter() - start_time)
+        print(f"{label:<22} {sorted(timings)[repeats // 2] * 1000:8.1f} ms   {peak_name} "
+              f"{peaks[label] / 2 ** 20:7.1f} MiB ({width}x{height}, median of {repeats})")
+    differing = np.any(results["float reference"] != results["fixed point in place"], axis=2).mean()
+    print(f"Pixels that differ between the two: {differing * 100:.3f}%")
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line. Everything has a default apart from the two folders, so the tool can run unattended.
+    """
+    parser = argparse.ArgumentParser(description="Batch convert dark mode screenshots to a light mode look for OCR")
+    parser.add_argument("input_folder", nargs="?", help="Folder containing the dark mode screenshots")
+    parser.add_argument("output_folder", nargs="?",
+                        help="Folder the light mode images (and the manifest) are saved to")
+    parser.add_argument("--threshold", type=int, default=220,
+                        help="Luminance threshold (0-255) above which pixels are forced to white (default 220)")
+    parser.add_argument("--upscale", type=int, default=2, help="Upscale factor, 1 for none (default 2)")
+    parser.add_argument("--no-sharpen", action="store_true", help="Skip the sharpen filter")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: one per CPU)")
+    parser.add_argument("--recursive", action="store_true", help="Also convert images in subfolders")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and convert every image again")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare the time and peak memory of the float and fixed point masking, then exit")
+    args = parser.parse_args(argv)
+    if not args.benchmark and not (args.input_folder and args.output_folder):
+        parser.error("input_folder and output_folder are required")
+    if not 0 <= args.threshold <= 255:
+        parser.error("--threshold must be between 0 and 255")
+    args.upscale = max(args.upscale, 1)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.benchmark:
+        benchmark_masking()
+        return
+    if not os.path.isdir(args.input_folder):
         print("Invalid input folder path.")
         sys.exit(1)
 
-    # Prompt for output folder
-    output_folder = input("Enter the path to the folder where light mode images will be saved: ").strip()
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Prompt for luminance threshold (default 220)
-    try:
-        threshold_str = input("Enter the luminance threshold (0-255, default=220): ").strip()
-        threshold = int(threshold_str) if threshold_str else 220
-    except ValueError:
-        print("Invalid threshold, using default of 220.")
-        threshold = 220
+    apply_sharpen = not args.no_sharpen
+    print(f"Processing images in:\n  {args.input_folder}\nSaving converted images to:\n  {args.output_folder}")
+    print(f"Luminance threshold = {args.threshold}, Upscale factor = {args.upscale}, Sharpen = {apply_sharpen}\n")
 
-    # Prompt for upscale factor (default 2)
-    try:
-        upscale_str = input("Enter the upscale factor (1=none, 2=2x, etc., default=2): ").strip()
-        upscale_factor = int(upscale_str) if upscale_str else 2
-        if upscale_factor < 1:
-            upscale_factor = 1
-    except ValueError:
-        print("Invalid upscale factor, using default of 2.")
-        upscale_factor = 2
-
-    # Prompt for sharpen (Y/N)
-    sharpen_str = input("Apply sharpen filter? (Y/N, default=Y): ").strip().lower()
-    apply_sharpen = (sharpen_str != 'n')
-
-    print(f"\nProcessing images in:\n  {input_folder}\nSaving converted images to:\n  {output_folder}")
-    print(f"Luminance threshold = {threshold}, Upscale factor = {upscale_factor}, Sharpen = {apply_sharpen}\n")
-
-    process_folder(input_folder, output_folder, threshold, upscale_factor, apply_sharpen)
-    print("Conversion complete.")
+    start_time = time.perf_counter()
+    converted, skipped, failed = process_folder(args.input_folder, args.output_folder, args.threshold, args.upscale,
+                                                apply_sharpen, args.workers, args.recursive, args.force)
+    elapsed = time.perf_counter() - start_time
+    print(f"Conversion complete: {converted} converted, {skipped} skipped, {failed} failed in {elapsed:.1f}s.")
 
 
 if __name__ == '__main__':
@@ -1,9 +1,25 @@
+import importlib.util
+import os
+import sys
 import time
 import threading
+import numpy as np
+import pygame
 import pytest
-from Final_Commented import App
-from PIL import Image
-import pyautogui
+import Final_Commented
+from Final_Commented import (AdaptiveScheduler, App, AgeOCRProcessor, BaseOCRProcessor, CaptureRegion,
+                             DirectoryCaptureBackend, FrameBuffer, FrameGrabber, NameOCRProcessor, NumpyPreprocessor,
+                             OCRResultCache, OCRWorkerPool, PerceptualChangeDetector, RegionChangeDetector,
+                             RegionRegistry, SessionCaptureBackend, SessionRecorder, SessionReplay, TesseractAPIBackend,
+                             XShmCaptureBackend, open_capture_backend, open_database)
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+# dark to light mode.py has spaces in its name, so it is loaded from its path rather than imported
+spec = importlib.util.spec_from_file_location(
+    "dark_to_light_mode", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dark to light mode.py"))
+dark_to_light_mode = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = dark_to_light_mode   # So the converter's worker processes can find convert_job
+spec.loader.exec_module(dark_to_light_mode)
 
 
 # Dummy output class to simulate tkinter output so update_output_window works
@@ -15,18 +31,6 @@ class DummyOutput:
         self.config.update(kwargs)
 
 
-# Monkeypatch function to simulate screenshot returning real test images
-def fake_screenshot(region=None):
-    # We assume test_age.png and test_name.png exist in the working directory
-    if region == (0, 0, 100, 100):  # For age region
-        return Image.open("test_age.png")
-    elif region == (0, 0, 100, 100,):  # For name region (using same dummy coords)
-        return Image.open("test_name.png")
-    else:
-        # Return a plain image if region is unexpected
-        return Image.new("RGB", (100, 100), color="white")
-
-
 # Test for age-based vaccine categorization logic via update_output_window
 def test_vaccine_color_logic():
     app = App()
@@ -53,41 +57,512 @@ def test_vaccine_color_logic():
     assert bg_color_high == "#0000FF", f"Expected blue for age 65 but got {bg_color_high}"
 
 
-# Test for refresh interval using ocr_loop with real test images
+# Test that the OCR scheduler polls at the minimum interval after a change and backs off exponentially while idle
 def test_refresh_interval():
-    app = App()
-    dummy = DummyOutput()
-    app.output_window = dummy
-    app.output_label = dummy
-    # Set dummy regions so that ocr_loop proceeds
-    app.age_rect = (0, 0, 100, 100)
-    app.name_rect = (0, 0, 100, 100)
+    scheduler = AdaptiveScheduler(min_interval=0.1, max_interval=0.5)
+    assert scheduler.next_interval(changed=True) == pytest.approx(0.1)
+    idle_waits = [scheduler.next_interval(changed=False) for _ in range(4)]
+    assert idle_waits == pytest.approx([0.2, 0.4, 0.5, 0.5]), f"Expected exponential back off, got {idle_waits}"
+    # A change on screen brings the polling straight back to the fastest rate
+    assert scheduler.next_interval(changed=True) == pytest.approx(0.1)
+
+
+# Test that an app given a scratch database records patients there and leaves the real database alone
+def test_app_records_into_given_database():
+    real_database = Final_Commented.test
+    scratch = open_database(":memory:")
+    app = App(capture_backend=DirectoryCaptureBackend("test_age.png"), database=scratch)
+    app.record_patient(72, "Benchmark Patient", "Blue")
+    assert scratch.execute("SELECT age, patient_name FROM patient").fetchall() == [(72, "Benchmark Patient")]
+    assert scratch.execute("SELECT COUNT(*) FROM vaccination").fetchone()[0] == 1
+    stored = real_database.execute("SELECT COUNT(*) FROM patient WHERE patient_name = 'Benchmark Patient'")
+    assert stored.fetchone()[0] == 0, "The patient was written to NHS Database.sqlite"
 
-    # Monkeypatch pyautogui.screenshot to return test images
-    original_screenshot = pyautogui.screenshot
-    pyautogui.screenshot = fake_screenshot
 
-    # Set dummy OCR results to simulate processing
-    app.latest_ocr_number = 50
-    app.latest_patient_name = "Refresh Test"
+# Test that an idle ocr_loop keeps polling but never waits longer than the maximum interval
+def test_idle_ocr_loop_polls_within_max_interval():
+    # Replays test_age.png instead of the screen, so no monkeypatching of pyautogui is needed
+    app = App(capture_backend=DirectoryCaptureBackend("test_age.png"),
+              scheduler=AdaptiveScheduler(min_interval=0.05, max_interval=0.2))
+    app.age_rect = (0, 0, 62, 51)
+    app.name_rect = (0, 0, 62, 51)
+    app.change_detector.has_changed("age", app.capture_backend.screenshot(region=app.age_rect))
+    app.change_detector.has_changed("name", app.capture_backend.screenshot(region=app.name_rect))
 
-    # Run ocr_loop in a separate thread and measure elapsed time
     app.ocr_active = True
-    start_time = time.time()
     t = threading.Thread(target=app.ocr_loop)
     t.start()
-    # Let the loop run for a little over 5 seconds (one full refresh cycle)
-    time.sleep(6)
+    time.sleep(1)
     app.ocr_active = False
-    t.join()
-    end_time = time.time()
-    elapsed = end_time - start_time
+    t.join(timeout=1)
+
+    # Nothing changed so every poll was a hit, and a 1 second run at up to 0.2s per wait gives at least 4 polls
+    assert not t.is_alive(), "ocr_loop did not stop within one maximum interval"
+    assert app.change_detector.stats["age"]["hits"] >= 4
+    assert app.scheduler.interval == pytest.approx(0.2)
+
+
+# Test that the OCR worker stops within milliseconds even while backed off, and that starting it twice reuses it
+def test_ocr_worker_lifecycle():
+    app = App(capture_backend=DirectoryCaptureBackend("test_age.png"),
+              scheduler=AdaptiveScheduler(min_interval=5, max_interval=5))
+    assert app.start_ocr()
+    first_thread = app.ocr_thread
+    assert app.start_ocr()
+    assert app.ocr_thread is first_thread, "A second OCR loop was started"
+    time.sleep(0.2)  # Let the worker settle into its 5 second wait
+
+    start_time = time.time()
+    assert app.stop_ocr()
+    elapsed = time.time() - start_time
+    assert elapsed < 0.1, f"Stopping the OCR worker took {elapsed}s"
+    assert not first_thread.is_alive()
+
+
+# Processor that counts preprocessing runs and records what process_ocr was handed, so no tesseract is needed
+class CountingProcessor(AgeOCRProcessor):
+    def __init__(self):
+        super().__init__()
+        self.preprocessed = 0
+        self.ocr_inputs = []
+
+    def process_image(self, screenshot):
+        self.preprocessed += 1
+        return super().process_image(screenshot)
+
+    def process_ocr(self, screenshot, processed_image=None):
+        processed_image = self.prepare(screenshot, processed_image)
+        self.ocr_inputs.append(processed_image)
+        return 70
+
+
+# Test that each changed region is preprocessed once per tick and tesseract reads the same image the preview shows
+def test_ocr_tick_preprocesses_each_region_once():
+    app = App(capture_backend=DirectoryCaptureBackend("test_age.png"))
+    for name in ("age", "name"):
+        region = app.regions.get(name)
+        region.processor = CountingProcessor()
+        region.rect = (0, 0, 62, 51)
+    app.ocr_active = True
+    assert app.ocr_tick()
+    app.ocr_active = False
+    for name in ("age", "name"):
+        region = app.regions.get(name)
+        assert region.processor.preprocessed == 1, f"{name} was preprocessed {region.processor.preprocessed} times"
+        processed = region.processor.ocr_inputs[0]
+        assert region.image.get_size() == processed.size
+
+
+# Test that the directory backend replays every image in a folder in order and loops back to the start
+def test_directory_capture_backend():
+    backend = DirectoryCaptureBackend("darkmode")
+    sizes = [backend.screenshot().size for _ in range(len(backend.paths) + 1)]
+    assert sizes[0] == sizes[-1], "Expected the replay to loop back to the first image"
+    assert backend.screenshot(region=(0, 0, 10, 20)).size == (10, 20)
+
+
+# Test that an unchanged region is reported as a hit and a changed one as a miss
+def test_region_change_detector():
+    detector = RegionChangeDetector()
+    white = Image.new("RGB", (50, 20), color="white")
+    black = Image.new("RGB", (50, 20), color="black")
+    assert detector.has_changed("age", white)
+    assert not detector.has_changed("age", white.copy())
+    assert detector.has_changed("age", black)
+    assert detector.stats["age"] == {"hits": 1, "misses": 2}
+
+
+# Test that the perceptual detector ignores a repaint with a slightly different background but notices a single
+# changed character of small text, a thin letter or caret, and text in a low contrast colour scheme
+def test_perceptual_change_detector():
+    def record(text, size=14, caret=False, fill="black", background="white", jitter=()):
+        image = Image.new("RGB", (120, 30), color=background)
+        draw = ImageDraw.Draw(image)
+        draw.text((4, 4), text, fill=fill, font=ImageFont.load_default(size=size))
+        if caret:
+            draw.line([(60, 4), (60, 22)], fill=fill)
+        for point in jitter:
+            image.putpixel(point, (0, 0, 0))
+        return image
+
+    detector = PerceptualChangeDetector({"age": AgeOCRProcessor(), "name": NameOCRProcessor()})
+    assert detector.has_changed("age", record("64"))
+    assert not detector.has_changed("age", record("64"))
+    assert not detector.has_changed("age", record("64", background=(240, 240, 240))), "A repaint counted as a change"
+    tolerant = PerceptualChangeDetector({"age": AgeOCRProcessor()}, max_distance=4)
+    tolerant.has_changed("age", record("64"))
+    assert not tolerant.has_changed("age", record("64", jitter=[(100, 2), (110, 26)])), "Jitter counted as a change"
+    assert detector.has_changed("age", record("64", caret=True)), "The caret appearing was missed"
+    assert detector.has_changed("age", record("64")), "The caret disappearing was missed"
+    # Each of these only differs by a few pixels of 1-2px strokes, the 64 to 65 one crossing the vaccine boundary
+    for text in ("65", "54", "7", "71", "17", ""):
+        assert detector.has_changed("age", record(text)), f"Changing the age to {text!r} was missed"
+    # Adding or removing a one pixel wide letter looks much like a caret blinking
+    for size in (11, 12, 13, 14):
+        for old, new in (("Jill", "Jil"), ("Bill", "Bil"), ("Al", "Ali"), ("Ann L", "Ann Li"), ("Ali", "All"),
+                         ("Liam", "Llam"), ("Jo", "Jo I")):
+            detector.has_changed("name", record(old, size))
+            assert detector.has_changed("name", record(new, size)), f"{old!r} to {new!r} at {size}px was missed"
+    assert detector.has_changed("name", record("Anne Lee"))
+    assert detector.has_changed("name", record("Anna Lee"))
+    grey = {"size": 16, "fill": (150, 150, 150), "background": (210, 210, 210)}
+    detector.has_changed("name", record("Anne Lee", **grey))
+    assert detector.has_changed("name", record("Bob Smith", **grey)), "A change of grey on grey text was missed"
+
+
+# Test that the region registry hands out selected regions by priority and respects each region's poll interval
+def test_region_registry_priority_and_poll_interval():
+    registry = RegionRegistry()
+    name = registry.add(CaptureRegion("name", "Name", NameOCRProcessor(), priority=10))
+    slow = registry.add(CaptureRegion("slow", "Slow", NameOCRProcessor(), poll_interval=2.0, priority=1))
+    age = registry.add(CaptureRegion("age", "Age", AgeOCRProcessor(), priority=20))
+    unselected = registry.add(CaptureRegion("unused", "Unused", NameOCRProcessor(), priority=30))
+    for region in (name, slow, age):
+        region.rect = (0, 0, 10, 10)
+    assert registry.due(100.0) == [age, name, slow]
+    slow.last_read = 99.0
+    assert registry.due(100.0) == [age, name], "A region was read again before its poll interval elapsed"
+    assert unselected not in registry.selected()
+
+
+# Test that the NumPy preprocessing engine produces the same binarised image as the PIL reference chain, apart from
+# the odd edge pixel where LANCZOS smoothing tips a pixel the other way
+@pytest.mark.parametrize("path", ["test_age.png", "test_name.png"])
+def test_numpy_preprocessing_matches_pil_reference(path):
+    processor = NameOCRProcessor()
+    processor.preprocessor.stage("scale").adaptive = False   # The reference always scales by upscale_factor
+    screenshot = Image.open(path).convert("RGB")
+    reference = np.asarray(processor.process_image_pil(screenshot).convert("L"))
+    result = np.asarray(processor.process_image(screenshot))
+    # The NumPy engine crops to the text before upscaling, so compare against the same box of the reference
+    box = processor.preprocessor.stage("crop").last_box
+    left, top, right, bottom = (edge * processor.upscale_factor for edge in box)
+    reference = reference[top:bottom, left:right]
+    assert result.shape == reference.shape
+    assert (result == reference).mean() > 0.97
+
+
+# Test that the adaptive mode copes with a dim panel next to a bright one, and that the threshold chosen for a region
+# is reused until its histogram moves
+def test_adaptive_threshold_and_cache():
+    screenshot = Image.new("RGB", (256, 64), (150, 150, 150))
+    draw = ImageDraw.Draw(screenshot)
+    draw.rectangle((10, 10, 20, 50), fill=(110, 110, 110))     # Dim text on the grey panel
+    draw.rectangle((128, 0, 255, 63), fill=(240, 240, 240))    # Bright panel
+    draw.rectangle((160, 10, 170, 50), fill=(20, 20, 20))      # Dark text on the bright panel
+    preprocessor = NumpyPreprocessor(threshold=128, upscale_factor=1, threshold_mode="adaptive")
+    preprocessor.stage("crop").enabled = False
+    result = np.asarray(preprocessor.process(screenshot))
+    assert result[30, 15] == 0 and result[30, 165] == 0, "Text was lost"
+    assert result[5, 100] == 255 and result[5, 250] == 255, "Background came out black"
+
+    threshold = NumpyPreprocessor(threshold_mode="otsu").stage("threshold")
+    threshold.run(np.asarray(screenshot.convert("L"), np.uint16) << 8)
+    decision = threshold.cached_decision
+    screenshot.putpixel((0, 0), (0, 0, 0))                     # A repaint too small to shift the histogram
+    threshold.run(np.asarray(screenshot.convert("L"), np.uint16) << 8)
+    assert threshold.cached_decision is decision, "The threshold was recomputed for an unchanged region"
+    threshold.run(np.full((64, 256), 20 << 8, np.uint16))
+    assert threshold.cached_decision is not decision, "The threshold survived a histogram shift"
 
-    # Restore original screenshot function
-    pyautogui.screenshot = original_screenshot
+    # Adaptive mode reuses the tile thresholds, but text appearing in a blank tile or a bigger region redoes them
+    font = ImageFont.load_default(size=16)
+    preprocessor.stage("scale").adaptive = False
+    names = []
+    for text in ("Ann Lee", "Ann Leeds"):
+        names.append(Image.new("RGB", (200, 40), (150, 150, 150)))
+        ImageDraw.Draw(names[-1]).text((4, 8), text, fill=(100, 100, 100), font=font)
+    preprocessor.process(names[0])
+    cached = np.asarray(preprocessor.process(names[1]))
+    fresh = NumpyPreprocessor(threshold=128, upscale_factor=1, threshold_mode="adaptive")
+    fresh.stage("crop").enabled = False
+    fresh.stage("scale").adaptive = False
+    assert (cached == np.asarray(fresh.process(names[1]))).all(), "The new letters were wiped by a cached blank tile"
+    preprocessor.process(names[1].resize((300, 100)))
 
-    # Assert that elapsed time is at least 5 seconds (confirming that a sleep of 5 seconds occurred)
-    assert elapsed >= 5, f"Expected at least 5 seconds refresh interval, but elapsed time was {elapsed}s"
+
+# Test that a dark mode copy of a region is detected and comes out the same as the light original
+def test_dark_mode_region_is_inverted():
+    processor = NameOCRProcessor()
+    screenshot = Image.open("test_name.png").convert("RGB")
+    light = np.asarray(processor.process_image(screenshot))
+    assert not processor.preprocessor.stage("dark_mode").inverted
+    dark = np.asarray(processor.process_image(ImageOps.invert(screenshot)))
+    assert processor.preprocessor.stage("dark_mode").inverted, "Dark mode was not detected"
+    assert (light == dark).mean() > 0.99
+
+
+# Test that the padding around the text in a generously drawn region is cropped away before upscaling
+def test_crop_to_text():
+    processor = AgeOCRProcessor()
+    text = Image.open("test_age.png").convert("RGB")
+    padded = Image.new("RGB", (text.width + 200, text.height + 100), (255, 255, 255))
+    padded.paste(text, (120, 40))
+    processor.process_image(padded)
+    crop = processor.preprocessor.stage("crop")
+    left, top, right, bottom = crop.last_box
+    margin = crop.margin
+    assert left >= 120 - margin and top >= 40 - margin, "The padding was not cropped away"
+    assert right <= 120 + text.width + margin and bottom <= 40 + text.height + margin
+    assert crop.crop_ratio() < 100
+    blank = processor.process_image(Image.new("RGB", (40, 20), (255, 255, 255)))
+    assert blank.size == (120, 60), "A region with no text should be left whole"
+
+
+# Test that large text is passed through at 1x, small text is upscaled, and the choice is cached per region
+def test_text_height_aware_upscale():
+    screenshot = Image.open("test_name.png").convert("RGB")
+    large = NameOCRProcessor()
+    large.process_image(screenshot)
+    assert large.preprocessor.stage("scale").last_factor == 1, "35 pixel text should not need upscaling"
+    small = NameOCRProcessor()
+    small_text = screenshot.resize((screenshot.width // 3, screenshot.height // 3), Image.Resampling.LANCZOS)
+    small.process_image(small_text)
+    scale = small.preprocessor.stage("scale")
+    assert scale.last_factor >= 3, "12 pixel text should be upscaled"
+    decision = scale.cached_scale
+    small_text.putpixel((0, 0), (250, 250, 250))               # A different frame with the same text
+    small.process_image(small_text)
+    assert scale.calls == 2 and scale.cached_scale is decision
+
+
+# Test that changing a late stage's setting reuses the memoised output of every stage before it
+def test_pipeline_memoises_early_stages():
+    pipeline = NumpyPreprocessor(threshold_mode="otsu")
+    screenshot = Image.open("test_name.png").convert("RGB")
+    pipeline.process(screenshot)
+    pipeline.stage("scale").target_text_height = 48
+    pipeline.process(screenshot)
+    assert [stage.calls for stage in pipeline.stages] == [1, 1, 1, 1, 1, 2]
+    assert pipeline.stage("scale").last_factor == 2
+    pipeline.process(screenshot.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    assert [stage.calls for stage in pipeline.stages] == [2, 2, 2, 2, 2, 3], "A new frame must rerun every stage"
+
+
+# Test that the speckle filter removes scattered noise dots but leaves the text alone
+def test_denoise_removes_speckle():
+    text = Image.open("test_name.png").convert("RGB")
+    screenshot = Image.new("RGB", (text.width, text.height + 40), (255, 255, 255))
+    screenshot.paste(text, (0, 0))
+    clean = NumpyPreprocessor(threshold_mode="otsu")
+    clean.stage("crop").enabled = False
+    reference = np.asarray(clean.process(screenshot))
+    noisy = np.asarray(screenshot).copy()
+    noisy[text.height + 10::10, 5::10] = 0                      # Single black pixels dotted under the text
+    for mode in ("speckle", "open"):
+        pipeline = NumpyPreprocessor(threshold_mode="otsu")
+        pipeline.stage("crop").enabled = False
+        pipeline.stage("denoise").mode = mode
+        result = np.asarray(pipeline.process(Image.fromarray(noisy)))
+        factor = pipeline.stage("scale").last_factor
+        assert (result[text.height * factor:] == 255).all(), f"{mode} left noise dots behind"
+        assert pipeline.stage("denoise").pixels_changed >= 3 * 26
+        if mode == "speckle":
+            assert (result == reference).mean() > 0.995, "The speckle filter damaged the text"
+
+
+# Test the config parsing of the in-process tesseract backend, and reading both sample regions through it when
+# libtesseract and the language data are available
+def test_tesseract_api_backend():
+    page_mode, variables = TesseractAPIBackend.parse_config("--psm 7 -c tessedit_char_whitelist=0123456789")
+    assert page_mode == 7 and variables == {"tessedit_char_whitelist": "0123456789"}
+    try:
+        backend = TesseractAPIBackend(datapath="FINAL CODE AND DEPENDENCIES/Tesseract-OCR/tessdata")
+    except OSError:
+        pytest.skip("libtesseract is not installed")
+    age = AgeOCRProcessor(ocr_backend=backend)
+    name = NameOCRProcessor(ocr_backend=backend)
+    assert age.process_ocr(Image.open("test_age.png").convert("RGB")) == 72
+    assert name.process_ocr(Image.open("test_name.png").convert("RGB")) == "John Smith"
+    assert len(backend.handles) == 2, "Expected one handle per config"
+    age.process_ocr(Image.open("test_age.png").convert("RGB"))
+    assert len(backend.handles) == 2, "A handle was created twice for the same config"
+    backend.close()
+
+
+# Test that the OCR worker pool reads both sample regions in parallel and keeps its queue and latency metrics
+def test_ocr_worker_pool():
+    try:
+        TesseractAPIBackend().close()
+    except OSError:
+        pytest.skip("libtesseract is not installed")
+    age, name = AgeOCRProcessor(), NameOCRProcessor()
+    os.environ.setdefault("TESSDATA_PREFIX", os.path.abspath("FINAL CODE AND DEPENDENCIES/Tesseract-OCR/tessdata"))
+    pool = OCRWorkerPool(2, "api", {age.ocr_config, name.ocr_config})
+    try:
+        jobs = [(age.process_image(Image.open("test_age.png").convert("RGB")), age.ocr_config),
+                (name.process_image(Image.open("test_name.png").convert("RGB")), name.ocr_config)]
+        (age_text, age_confidence), (name_text, _) = pool.recognise_all(jobs)
+    finally:
+        pool.close()
+    assert age.parse_result(age_text) == 72 and name.parse_result(name_text) == "John Smith"
+    assert 0 <= age_confidence <= 100
+    assert pool.max_queue_depth == 2
+    assert sum(stats["reads"] for stats in pool.worker_stats.values()) == 2
+
+
+# Test that batch mode reads both sample regions from one composite and applies each region's own whitelist
+def test_batch_ocr():
+    try:
+        backend = TesseractAPIBackend()
+    except OSError:
+        pytest.skip("libtesseract is not installed")
+    os.environ.setdefault("TESSDATA_PREFIX", os.path.abspath("FINAL CODE AND DEPENDENCIES/Tesseract-OCR/tessdata"))
+    age, name = AgeOCRProcessor(), NameOCRProcessor()
+    age_image = age.process_image(Image.open("test_age.png").convert("RGB"))
+    name_image = name.process_image(Image.open("test_name.png").convert("RGB"))
+    try:
+        (age_text, age_confidence), (name_text, _) = backend.recognise_batch([(age_image, age.ocr_config),
+                                                                              (name_image, name.ocr_config)])
+        # The name read with the digit whitelist has every letter filtered out
+        (digits_text, digits_confidence), _ = backend.recognise_batch([(name_image, age.ocr_config),
+                                                                       (age_image, name.ocr_config)])
+    finally:
+        backend.close()
+    assert age.parse_result(age_text) == 72 and name.parse_result(name_text) == "John Smith"
+    assert 0 <= age_confidence <= 100
+    assert digits_text == "" and digits_confidence is None
+
+
+# Backend that counts its reads instead of running tesseract
+class CountingBackend:
+    def __init__(self, confidence=95):
+        self.reads = 0
+        self.confidence = confidence
+
+    def recognise(self, image, config=""):
+        self.reads += 1
+        return "72", self.confidence
+
+
+# Test that a repeated region is read from the OCR cache, the oldest entry is evicted and the cache survives a restart
+def test_ocr_result_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    backend = CountingBackend()
+    processor = AgeOCRProcessor(ocr_backend=backend, use_templates=False)
+    screenshot = Image.open("test_age.png").convert("RGB")
+    BaseOCRProcessor.ocr_cache = OCRResultCache(2, path)
+    try:
+        assert processor.process_ocr(screenshot) == 72
+        assert processor.process_ocr(screenshot.copy()) == 72
+        assert backend.reads == 1, "An identical region was read by tesseract twice"
+        for size in (90, 80):
+            processor.process_ocr(screenshot.resize((size, screenshot.height)))
+        assert backend.reads == 3 and len(BaseOCRProcessor.ocr_cache.entries) == 2
+        assert BaseOCRProcessor.ocr_cache.hit_rate() == 25.0
+        BaseOCRProcessor.ocr_cache.close()
+        BaseOCRProcessor.ocr_cache = OCRResultCache(2, path)
+        processor.process_ocr(screenshot.resize((80, screenshot.height)))
+        processor.process_ocr(screenshot)
+        assert backend.reads == 4, "The restored cache should hold only the two most recent entries"
+    finally:
+        BaseOCRProcessor.ocr_cache.close()
+        BaseOCRProcessor.ocr_cache = None
+
+
+# Test that the age is read by template matching once tesseract has read it, including the digits in a new order,
+# and that anything the atlas cannot match still goes to tesseract
+def test_digit_template_matcher():
+    backend = CountingBackend()
+    processor = AgeOCRProcessor(ocr_backend=backend)
+    processed = processor.process_image(Image.open("test_age.png").convert("RGB"))
+    assert processor.process_ocr(None, processed) == 72
+    assert processor.process_ocr(None, processed) == 72
+    assert backend.reads == 1, "The second read should have come from the glyph atlas"
+    # Swaps the two glyphs at the blank column between them to make 27
+    pixels = np.asarray(processed)
+    ink_columns = (pixels < 128).any(axis=0)
+    gap = ink_columns.argmax() + ink_columns[ink_columns.argmax():].argmin()
+    swapped = Image.fromarray(np.hstack((pixels[:, gap:], pixels[:, :gap])))
+    assert processor.process_ocr(None, swapped) == 27 and backend.reads == 1
+    processor.process_ocr(Image.open("test_name.png").convert("RGB"))
+    assert backend.reads == 2
+    # A read with no confidence, as from a backend that cannot report one, is never learned
+    backend = CountingBackend(confidence=None)
+    processor = AgeOCRProcessor(ocr_backend=backend)
+    processor.process_ocr(None, processed)
+    processor.process_ocr(None, processed)
+    assert backend.reads == 2 and not processor.digit_matcher.labels
+
+
+# Test that a raw BGRX capture, as XShm returns it with a zero pad byte, shows as opaque colour once cropped to a surface
+def test_frame_buffer_bgrx_surface():
+    pixels = bytes([10, 20, 30, 0]) * 12                          # Blue, green, red, pad for a 4x3 frame
+    frame = FrameBuffer(pixels, (4, 3), "BGRX")
+    assert frame.to_image().getpixel((3, 2)) == (30, 20, 10)
+    for surface in (frame.to_surface(), frame.crop((1, 1, 2, 2)).to_surface()):
+        background = pygame.Surface(surface.get_size())
+        background.fill((0, 0, 0))
+        background.blit(surface, (0, 0))
+        assert background.get_at((0, 0))[:3] == (30, 20, 10), "The pad byte was treated as transparent alpha"
+
+
+# Test that a recorded session replays the exact pixels captured, with repeated frames of a region left out
+def test_session_recorder_round_trip(tmp_path):
+    path = str(tmp_path / "session.bin")
+    age = Image.open("test_age.png")
+    name = Image.open("test_name.png").convert("RGB")
+    recorder = SessionRecorder(path)
+    assert recorder.record("age", age, timestamp=1.0)
+    assert not recorder.record("age", age.copy(), timestamp=2.0), "An unchanged region was recorded twice"
+    assert recorder.record("name", name, timestamp=3.0)
+    recorder.close()
+
+    replay = SessionReplay(path)
+    records = [(timestamp, region, image.tobytes()) for timestamp, region, image in replay]
+    replay.close()
+    assert records == [(1.0, "age", age.tobytes()), (3.0, "name", name.tobytes())]
+
+
+# Test that a recording opened with --source replays each tick's regions as frames the frame grabber can slice,
+# with a region that did not change in a tick keeping its last image, and that frames are only built when needed
+def test_session_capture_backend(tmp_path):
+    path = str(tmp_path / "session.bin")
+    age = Image.open("test_age.png").convert("RGB")
+    name = Image.open("test_name.png").convert("RGB")
+    older_age, newer_name = ImageOps.mirror(age), ImageOps.mirror(name)
+    ticks = [(older_age, name), (age, name), (age, newer_name)]
+    recorder = SessionRecorder(path)
+    for tick, (age_image, name_image) in enumerate(ticks):
+        # An unchanged region is skipped, so the last two ticks hold one record each
+        recorder.record("age", age_image, timestamp=tick)
+        recorder.record("name", name_image, timestamp=tick)
+    recorder.close()
+
+    backend = open_capture_backend(path)
+    try:
+        assert isinstance(backend, SessionCaptureBackend) and len(backend.ticks) == 3
+        assert not backend.frames, "Frames were built before they were needed"
+        grabber = FrameGrabber(backend)
+        for name_of_region, rect in backend.region_rects.items():
+            grabber.register(name_of_region, rect)
+        for expected_age, expected_name in ticks:
+            crops = grabber.grab()
+            assert crops["age"].tobytes() == expected_age.tobytes()
+            assert crops["name"].tobytes() == expected_name.tobytes()
+            assert len(backend.frames) == 1
+    finally:
+        backend.close()
+
+
+# Test the X11 shared memory backend against a real X server, e.g. run under "xvfb-run -s '-screen 0 800x600x24'"
+@pytest.mark.skipif(not sys.platform.startswith("linux") or not os.environ.get("DISPLAY"),
+                    reason="needs an X server such as Xvfb")
+def test_xshm_capture_backend():
+    backend = XShmCaptureBackend()
+    try:
+        width, height = backend.size()
+        assert backend.screenshot().size == (width, height)
+        region = backend.screenshot(region=(10, 20, 30, 40))
+        assert region.size == (30, 40) and region.mode == "RGB"
+        data, size, bytes_per_line, raw_mode = backend.raw_screenshot(region=(10, 20, 30, 40))
+        assert size == (30, 40) and len(data) == bytes_per_line * 40
+        # The same region read twice in a row reuses the shared memory image rather than making a new one
+        shm_image = backend.shm_image
+        backend.screenshot(region=(10, 20, 30, 40))
+        assert backend.shm_image is shm_image
+    finally:
+        backend.close()
 
 
 # Test for application startup time
@@ -97,3 +572,55 @@ def test_app_startup_time():
     end_time = time.time()
     startup_time = end_time - start_time
     assert startup_time <= 2, f"Application startup too slow: {startup_time}s"
+
+
+# Test that the in place fixed point masking matches the float reference, apart from pixels whose luminance is within
+# rounding of the threshold
+@pytest.mark.parametrize("threshold", [128, 220])
+def test_invert_and_whiten_matches_reference(threshold):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    expected = dark_to_light_mode.invert_and_whiten_reference(Image.fromarray(pixels), threshold)
+    result = dark_to_light_mode.invert_and_whiten(pixels.copy(), threshold)
+    differing = np.any(result != expected, axis=2)
+    inverted = 255 - pixels.astype(np.float64)
+    luminance = 0.299 * inverted[..., 0] + 0.587 * inverted[..., 1] + 0.114 * inverted[..., 2]
+    assert differing.mean() < 0.01
+    assert (np.abs(luminance[differing] - threshold) < 1).all(), "A pixel away from the threshold was masked wrongly"
+
+
+# Test that the converter skips images the manifest says are up to date, and converts them again when the parameters
+# or the file's modification time change
+def test_dark_to_light_manifest(tmp_path):
+    input_folder, output_folder = tmp_path / "dark", tmp_path / "light"
+    input_folder.mkdir()
+    for index in range(2):
+        Image.new("RGB", (16, 8), (20 * index, 20, 20)).save(input_folder / f"frame{index}.png")
+
+    def convert(threshold=220):
+        return dark_to_light_mode.process_folder(str(input_folder), str(output_folder), threshold, 1, False, workers=1)
+
+    assert convert() == (2, 0, 0)
+    assert (output_folder / "frame0.png").exists()
+    assert convert() == (0, 2, 0), "Unchanged images were converted again"
+    assert convert(threshold=200) == (2, 0, 0), "Images were skipped after the threshold changed"
+    touched = input_folder / "frame1.png"
+    os.utime(touched, (touched.stat().st_atime, touched.stat().st_mtime + 10))
+    assert convert(threshold=200) == (1, 1, 0), "An image modified since the last run was skipped"
+
+
+# Test that regions at different offsets are sliced correctly out of the single capture of their bounding box
+def test_frame_grabber_crops_regions_from_union():
+    class RecordingBackend(DirectoryCaptureBackend):
+        def screenshot(self, region=None):
+            self.requested = region
+            return super().screenshot(region)
+
+    screen = Image.open("test_name.png").convert("RGB")
+    grabber = FrameGrabber(RecordingBackend("test_name.png"))
+    grabber.register("age", (5, 3, 20, 10))
+    grabber.register("name", (30, 15, 40, 12))
+    crops = grabber.grab()
+    assert grabber.backend.requested == (5, 3, 65, 24), "The capture was not the union of the two regions"
+    for name, (x, y, w, h) in grabber.regions.items():
+        assert crops[name].tobytes() == screen.crop((x, y, x + w, y + h)).tobytes(), f"{name} was cropped wrongly"